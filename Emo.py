@@ -5,6 +5,7 @@ import sys
 from dotenv import load_dotenv
 from flask import Flask
 import threading
+from database import Database
 
 # Flask web server setup
 app = Flask(__name__)
@@ -23,12 +24,53 @@ threading.Thread(target=run_flask, daemon=True).start()
 # Load the token from .env file
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
+MONGO_URI = os.getenv('MONGO_URI')
+
+class EmoBot(commands.Bot):
+    """Bot that owns the shared MongoDB connection pool the cogs borrow"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = None
+    
+    async def close(self):
+        # Unload cogs first so they can finish their writes, then release the pool
+        await super().close()
+        if self.db:
+            self.db.close()
+
+async def setup_database():
+    """Create the shared MongoDB connection pool and bootstrap indexes once"""
+    if not MONGO_URI:
+        print("WARNING: MONGO_URI not found in .env file!")
+        print("Falling back to in-memory storage. Data will be lost on restart.")
+        return None
+    try:
+        db = Database(
+            MONGO_URI,
+            max_pool_size=int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+            min_pool_size=int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+            server_selection_timeout_ms=int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            connect_timeout_ms=int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 10000)),
+            wait_queue_timeout_ms=int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000))
+        )
+    except Exception as e:
+        print(f"Failed to connect to MongoDB: {e}")
+        print("Falling back to in-memory storage. Data will be lost on restart.")
+        return None
+    
+    # A failed index build slows queries down but shouldn't disable MongoDB
+    try:
+        await db.ensure_indexes()
+        print("Successfully connected to MongoDB")
+    except Exception as e:
+        print(f"Error creating MongoDB indexes: {e}")
+    return db
 
 # Set up the bot with necessary intents
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+bot = EmoBot(command_prefix='!', intents=intents)
 
 # Comprehensive error handling
 @bot.event
@@ -65,6 +107,10 @@ async def on_ready():
     # Start the status update task
     status_update.start()
     
+    # Connect to MongoDB before the cogs that borrow the connection are loaded
+    if bot.db is None:
+        bot.db = await setup_database()
+    
     # Load cogs
     cogs_to_load = [
         'cogs.private_groups',
@@ -87,5 +133,25 @@ async def on_ready():
 async def test(ctx):
     await ctx.send("Test command works!")
 
+@bot.command()
+@commands.is_owner()
+async def stats(ctx):
+    """Show cache and performance counters from the loaded cogs"""
+    lines = []
+    if bot.db:
+        lines.append("[mongo_pool]")
+        lines.extend(f"  {key}: {value}" for key, value in bot.db.stats().items())
+    for cog_name, cog in bot.cogs.items():
+        if not hasattr(cog, 'get_stats'):
+            continue
+        for section, values in cog.get_stats().items():
+            lines.append(f"[{cog_name}.{section}]")
+            lines.extend(f"  {key}: {value}" for key, value in values.items())
+    
+    if not lines:
+        await ctx.send("No stats available yet.")
+        return
+    await ctx.send("```\n" + "\n".join(lines)[:1900] + "\n```")
+
 # Run the bot using the token from .env
 bot.run(TOKEN)
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""ContextCache against a slow stub backend: turns must never wait on cache creation
+
+Run from the repository root:
+    python benchmarks/bench_context_cache.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from context_cache import ContextCache
+
+class StubBackend:
+    """Same interface as the real backends; every call takes `latency` seconds"""
+    def __init__(self, latency):
+        self.latency = latency
+        self.created = []
+        self.deleted = []
+
+    async def create(self, system_instruction, contents, ttl):
+        await asyncio.sleep(self.latency)
+        handle = f"cache-{len(self.created)}"
+        self.created.append(handle)
+        return handle
+
+    async def refresh(self, handle, ttl):
+        await asyncio.sleep(self.latency)
+
+    async def delete(self, handle):
+        await asyncio.sleep(self.latency)
+        self.deleted.append(handle)
+
+    def model_for(self, handle, generation_config):
+        return f"model-for-{handle}"
+
+def prefix(text):
+    return [{"role": "user", "parts": [{"text": text}]}]
+
+async def timed(cache, *args):
+    start = time.perf_counter()
+    model = await cache.get_model(*args)
+    return model, (time.perf_counter() - start) * 1000
+
+async def settle(cache):
+    while cache.tasks:
+        await asyncio.gather(*cache.tasks)
+
+async def main():
+    backend = StubBackend(latency=0.2)
+    cache = ContextCache(backend, {}, ttl=900, min_tokens=50)
+    sheets = "Character sheet. " * 100
+
+    # A new prefix is created in the background; the turn goes out uncached right away
+    model, ms = await timed(cache, "game", "system", prefix(sheets))
+    print(f"new prefix:      {ms:6.2f} ms  model={model}")
+    assert model is None and ms < 50
+    await settle(cache)
+
+    # Once created, the same prefix is served from the cache
+    model, ms = await timed(cache, "game", "system", prefix(sheets))
+    print(f"cached prefix:   {ms:6.2f} ms  model={model}")
+    assert model == "model-for-cache-0"
+
+    # A changed prefix falls back at once and replaces the old cache in the background
+    model, ms = await timed(cache, "game", "system", prefix(sheets + "New equipment."))
+    print(f"changed prefix:  {ms:6.2f} ms  model={model}")
+    assert model is None and ms < 50
+    await settle(cache)
+    assert backend.deleted == ["cache-0"]
+
+    # Prefixes below min_tokens never reach the backend
+    model, ms = await timed(cache, "small", "system", prefix("tiny"))
+    print(f"small prefix:    {ms:6.2f} ms  model={model}")
+    await settle(cache)
+    assert model is None and len(backend.created) == 2
+
+    # Discarding a key deletes its cache and forgets the entry
+    await cache.discard("game")
+    await cache.discard("small")
+    assert backend.deleted == ["cache-0", "cache-1"] and not cache.entries
+    print(cache.stats())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""Microbenchmark: single-pass narration_parser vs the old chain of regex scans
+
+Run from the repository root:
+    python benchmarks/bench_narration_parser.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from narration_parser import parse_narration
+
+def legacy_parse(narration, acting_char):
+    """The previous EmoNarration pipeline: one scan per tag or phrase, first match only"""
+    events = []
+    if "SCENE:" in narration:
+        scene_match = re.search(r"SCENE: (.+?)(?=\n|$)", narration)
+        if scene_match:
+            events.append(("scene", None, scene_match.group(1)))
+            narration = narration.replace(scene_match.group(0), "")
+    if "NPC:" in narration:
+        npc_matches = re.findall(r"NPC: ([^:]+): (.+?)(?=\n|$)", narration)
+        for npc_name, npc_desc in npc_matches:
+            events.append(("npc", npc_name.strip(), npc_desc.strip()))
+            narration = narration.replace(f"NPC: {npc_name}: {npc_desc}", "")
+    narration = narration.strip()
+
+    hp_match = re.search(r"(\w+) takes (\d+) damage", narration, re.IGNORECASE)
+    if hp_match and hp_match.group(1) == acting_char:
+        events.append(("hp", acting_char, -int(hp_match.group(2))))
+    heal_match = re.search(r"(\w+) heals for (\d+)", narration, re.IGNORECASE)
+    if heal_match and heal_match.group(1) == acting_char:
+        events.append(("hp", acting_char, int(heal_match.group(2))))
+    exp_match = re.search(r"(\w+) gains (\d+) EXP", narration, re.IGNORECASE)
+    if exp_match and exp_match.group(1) == acting_char:
+        events.append(("exp", acting_char, int(exp_match.group(2))))
+    if "PENDING_ROLL:" in narration:
+        match = re.search(r"PENDING_ROLL: (\w+) must roll (.+)", narration)
+        if match:
+            char_name, roll = match.groups()
+            events.append(("roll", char_name, roll))
+            narration = narration.replace(match.group(0), f"{char_name}, please roll {roll} in your next reply.")
+    return narration, events
+
+SAMPLES = {
+    "plain": "The tavern is warm and loud. A bard plays a cheerful tune while the party settles in.\n" * 3,
+    "tagged": (
+        "SCENE: A misty forest clearing at dawn, dew shining on the grass\n"
+        "NPC: Old Maren: a hunched herbalist with a lantern\n"
+        "NPC: Pip: a curious fox that follows the party\n"
+        "Maren waves you over. Aria takes 4 damage from a thorn bush, and Bram heals for 2.\n"
+        "Aria gains 10 EXP for spotting the hidden trail.\n"
+        "PENDING_ROLL: Bram must roll d20 + 1 to cross the stream\n"
+        "What do you do next?"
+    ),
+}
+
+def main():
+    number = 20000
+    for label, narration in SAMPLES.items():
+        legacy = timeit.timeit(lambda: legacy_parse(narration, "Aria"), number=number)
+        single_pass = timeit.timeit(lambda: parse_narration(narration), number=number)
+        print(f"{label:>8}: legacy {legacy / number * 1e6:7.2f} us   single pass {single_pass / number * 1e6:7.2f} us"
+              f"   ({legacy / single_pass:.2f}x)")
+        print(f"          legacy events: {len(legacy_parse(narration, 'Aria')[1])}"
+              f"   single pass events: {len(parse_narration(narration).events)}")
+
+if __name__ == "__main__":
+    main()
@@ -315,10 +315,11 @@ class CharacterCreation(commands.Cog):
             await ctx.author.send("Confirmation timed out. Character creation cancelled.")
             return
         
-        # Save character
-        game["characters"][user_id] = character_data
-        game["last_updated"] = datetime.now().isoformat()
-        await self.parent_cog.save_game(channel_id, game)
+        # Save character against the latest game state, retrying if another write lands first
+        game = await self.parent_cog.update_game(channel_id, self._character_setter(user_id, character_data))
+        if not game:
+            await ctx.author.send("The game ended before your character could be saved.")
+            return
         
         # Success embed
         success_embed = discord.Embed(
@@ -333,10 +334,16 @@ class CharacterCreation(commands.Cog):
         await ctx.send(f"Character created successfully for {ctx.author.mention}!", embed=success_embed)
         
         # Check if all players have characters
-        game = await self.parent_cog.get_game(channel_id)
         if len(game["characters"]) == len(game["player_ids"]):
             await ctx.send("As everyone made their character, now use `!campaign_setup` to set up the theme of your adventure!")
     
+    def _character_setter(self, user_id, character_data):
+        """Build an update_game mutation that stores a player's character"""
+        def set_character(latest):
+            latest.setdefault("characters", {})[user_id] = character_data
+            latest["last_updated"] = datetime.now().isoformat()
+        return set_character
+    
     def _add_character_fields(self, embed, character_data, author_name=None):
         """Helper to add character fields to an embed"""
         embed.add_field(name="Class", value=character_data.get("class", "Unknown"), inline=True)
@@ -561,9 +568,10 @@ class CharacterCreation(commands.Cog):
             response = await self.bot.wait_for('message', timeout=60.0, check=check_confirm)
             if response.content.lower() == "yes":
                 channel_id = str(ctx.channel.id)
-                game["characters"][user_id] = character_data
-                game["last_updated"] = datetime.now().isoformat()
-                await self.parent_cog.save_game(channel_id, game)
+                game = await self.parent_cog.update_game(channel_id, self._character_setter(user_id, character_data))
+                if not game:
+                    await ctx.author.send("The game ended before your character could be saved.")
+                    return True
                 success_embed = discord.Embed(
                     title=f"🎉 Character: {character_data.get('name', 'Unknown')}",
                     description=f"Created by {ctx.author.display_name}",
@@ -573,7 +581,6 @@ class CharacterCreation(commands.Cog):
                 success_embed.set_thumbnail(url=image_url)
                 await ctx.send(f"Character created successfully for {ctx.author.mention}!", embed=success_embed)
                 # Check if all players have characters
-                game = await self.parent_cog.get_game(channel_id)
                 if len(game["characters"]) == len(game["player_ids"]):
                     await ctx.send("As everyone made their character, now use `!campaign_setup` to set up the theme of your adventure!")
                 return True
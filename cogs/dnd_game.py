@@ -1,12 +1,9 @@
 import discord
 from discord.ext import commands
 import asyncio
-from pymongo import MongoClient
-import os
-import os.path
+import copy
 import random
 import json
-from dotenv import load_dotenv
 from datetime import datetime
 from discord import ui
 
@@ -99,37 +96,160 @@ class ConfirmButton(ui.Button):
         
         self.view.stop()
 
+def apply_hp_change(character, hp_change):
+    """Add hp_change to an in-memory character's HP, clamped to [0, max_hp]"""
+    character["hp"] = max(0, min(character.get("hp", 20) + hp_change, character.get("max_hp", 20)))
+
+def apply_exp_gain(character, exp_gain):
+    """Add EXP to an in-memory character and update its level if a threshold is met"""
+    character["exp"] = character.get("exp", 0) + exp_gain
+    # Level up: 20 EXP per level (e.g., 20 for level 2, 40 for level 3)
+    current_level = int(character.get("level", 1))
+    exp_threshold = current_level * 20
+    while character["exp"] >= exp_threshold:
+        current_level += 1
+        exp_threshold = current_level * 20
+    character["level"] = current_level
+
+class GameCache:
+    """Per-process game documents keyed by channel_id, indexed by IC channel and OOC thread
+
+    With MongoDB this is a write-through cache in front of the store; without it,
+    it is the store itself. Cached documents are shared, so treat them as read-only
+    and go through DnDGame.update_game to change a game.
+    """
+    def __init__(self):
+        self.games = {}
+        self.ic_channel_index = {}  # ic_channel_id -> channel_id
+        self.ooc_thread_index = {}  # ooc_thread_id -> channel_id
+        self.dirty = set()  # channel_ids with a write to the store in flight
+        self.hits = 0
+        self.misses = 0
+    
+    def _lookup(self, channel_id):
+        game = self.games.get(channel_id) if channel_id else None
+        if game is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return game
+    
+    def get(self, channel_id):
+        return self._lookup(str(channel_id))
+    
+    def get_by_ic_channel(self, ic_channel_id):
+        return self._lookup(self.ic_channel_index.get(str(ic_channel_id)))
+    
+    def get_by_ooc_thread(self, ooc_thread_id):
+        return self._lookup(self.ooc_thread_index.get(str(ooc_thread_id)))
+    
+    def put(self, channel_id, game):
+        channel_id = str(channel_id)
+        self.games[channel_id] = game
+        if game.get("ic_channel_id"):
+            self.ic_channel_index[game["ic_channel_id"]] = channel_id
+        if game.get("ooc_thread_id"):
+            self.ooc_thread_index[game["ooc_thread_id"]] = channel_id
+    
+    def merge(self, channel_id, partial):
+        """Fold a projected document returned by an atomic update into the cached game"""
+        game = self.games.get(str(channel_id))
+        if game is None or not partial:
+            return
+        for key, value in partial.items():
+            if key == "characters":
+                game.setdefault("characters", {}).update(value)
+            elif key != "_id":
+                game[key] = value
+    
+    def remove(self, channel_id):
+        game = self.games.pop(str(channel_id), None)
+        self.dirty.discard(str(channel_id))
+        if game:
+            self.ic_channel_index.pop(game.get("ic_channel_id"), None)
+            self.ooc_thread_index.pop(game.get("ooc_thread_id"), None)
+        return game
+    
+    def mark_dirty(self, channel_id):
+        self.dirty.add(str(channel_id))
+    
+    def mark_clean(self, channel_id):
+        self.dirty.discard(str(channel_id))
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.games),
+            "dirty": len(self.dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
 class DnDGame(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         
-        load_dotenv()
-        mongo_uri = os.getenv('MONGO_URI')
+        # Borrow the bot-wide MongoDB connection pool created in Emo.py
+        self.db = getattr(bot, 'db', None)
+        self.use_mongo = self.db is not None
+        self.game_cache = GameCache()
+        # IC channels of started games, so listeners can ignore other channels without any I/O
+        self.active_ic_channels = set()
+        # Without MongoDB the set starts out complete; otherwise only once the warm load succeeds
+        self.ic_channels_loaded = not self.use_mongo
+        self.warm_task = None
+        self.version_conflicts = 0  # Game saves rejected because another writer saved first
         
-        if not mongo_uri:
-            print("WARNING: MONGO_URI not found in .env file!")
-            self.use_mongo = False
-            self.active_games = {}
+        if self.use_mongo:
+            print("Using shared MongoDB connection for DnD games")
         else:
-            try:
-                self.mongo_client = MongoClient(mongo_uri)
-                self.db = self.mongo_client['emo_bot']
-                self.games_collection = self.db['dnd_games']
-                self.games_collection.create_index("channel_id", unique=True)
-                self.use_mongo = True
-                print("Successfully connected to MongoDB for DnD games")
-            except Exception as e:
-                print(f"Failed to connect to MongoDB: {e}")
-                self.use_mongo = False
-                self.active_games = {}
+            print("DnD games are using in-memory storage. Games will be lost on restart.")
                 
         self.gemini_model = None
+        self.gemini_client = None
+        self.gemini_chat = None
+    
+    async def cog_load(self):
+        if self.use_mongo:
+            try:
+                await self.warm_game_cache()
+            except Exception as e:
+                print(f"Error warming the game cache: {e}")
+                # Until a retry succeeds, listeners fall back to the indexed IC channel lookup
+                self.warm_task = asyncio.create_task(self.retry_warm_game_cache())
+    
+    async def cog_unload(self):
+        if self.warm_task:
+            self.warm_task.cancel()
+    
+    async def warm_game_cache(self):
+        """Warm the cache with every game that can still be played, in one query"""
+        games = await self.db.get_games_in_states(["setup", "active", "started"])
+        for game in games:
+            self.game_cache.put(game["channel_id"], game)
+        # Games started while the load was retried are already in the set
+        self.active_ic_channels |= {game["ic_channel_id"] for game in games if game.get("ic_channel_id")}
+        self.ic_channels_loaded = True
+        print(f"Cached {len(games)} games, tracking {len(self.active_ic_channels)} active IC channels")
+    
+    async def retry_warm_game_cache(self):
+        delay = 5
+        while not self.ic_channels_loaded:
+            await asyncio.sleep(delay)
+            try:
+                await self.warm_game_cache()
+            except Exception as e:
+                print(f"Error warming the game cache, retrying in {min(delay * 2, 300)}s: {e}")
+                delay = min(delay * 2, 300)
     
     async def setup_gemini_model(self):
         if not self.gemini_model:
             gemini_cog = self.bot.get_cog('GeminiChat')
             if gemini_cog and hasattr(gemini_cog, 'model'):
                 self.gemini_model = gemini_cog.model
+                self.gemini_chat = gemini_cog
+                self.gemini_client = gemini_cog.client
                 print("Successfully connected to Gemini model for DnD features")
             else:
                 print("WARNING: GeminiChat cog not found or has no 'model' attribute.")
@@ -140,73 +260,200 @@ class DnDGame(commands.Cog):
             return "Sorry, my storytelling brain isn't working right now. Check if GeminiChat is set up correctly!"
         
         try:
-            chat = self.gemini_model.start_chat(history=[])
-            await asyncio.to_thread(chat.send_message, system_prompt)
-            response = await asyncio.to_thread(chat.send_message, user_prompt)
+            # The system prompt rides on the model, so each request is a single Gemini call
+            model = self.gemini_chat.get_model(system_prompt)
+            chat = model.start_chat(history=history or [])
+            response = await self.gemini_client.send_message(chat, user_prompt)
             return response.text
         except Exception as e:
             print(f"Error getting Gemini response: {e}")
             return "Sorry, I tripped over my own code. Try again!"
     
     async def get_game(self, channel_id):
-        if not self.use_mongo:
-            return self.active_games.get(str(channel_id))
-        else:
-            return self.games_collection.find_one({"channel_id": str(channel_id)})
+        game = self.game_cache.get(channel_id)
+        if game is not None or not self.use_mongo:
+            return game
+        game = await self.db.get_game(channel_id)
+        if game:
+            self.game_cache.put(channel_id, game)
+        return game
+    
+    async def _write_through(self, channel_id, write):
+        """Run a store write for a cached game, dropping the cached copy if the write fails"""
+        self.game_cache.mark_dirty(channel_id)
+        try:
+            result = await write
+        except Exception:
+            self.game_cache.remove(channel_id)
+            raise
+        self.game_cache.mark_clean(channel_id)
+        return result
     
     async def save_game(self, channel_id, game_data):
+        """Save a game only if nobody saved a newer version since it was read.
+        
+        Returns False on a version conflict; use update_game to retry automatically.
+        Every successful write to a game dispatches a game_updated event with its channel ID.
+        """
         if not self.use_mongo:
-            self.active_games[str(channel_id)] = game_data
+            current = self.game_cache.games.get(str(channel_id))
+            if current is not None and current is not game_data and current.get("version", 0) != game_data.get("version", 0):
+                self.version_conflicts += 1
+                return False
+            game_data["version"] = game_data.get("version", 0) + 1
+            self.game_cache.put(channel_id, game_data)
+            self.bot.dispatch("game_updated", str(channel_id))
+            return True
+        
+        saved = await self._write_through(channel_id, self.db.save_game(channel_id, game_data))
+        if saved:
+            cached = self.game_cache.games.get(str(channel_id))
+            if cached is not None and cached.get("version", 0) > game_data["version"]:
+                # An atomic update landed after our save and was merged into the cached copy;
+                # game_data lacks it, so let the next read fetch the latest document instead
+                self.game_cache.remove(channel_id)
+            else:
+                self.game_cache.put(channel_id, game_data)
+            self.bot.dispatch("game_updated", str(channel_id))
         else:
-            self.games_collection.update_one(
-                {"channel_id": str(channel_id)},
-                {"$set": game_data},
-                upsert=True
-            )
+            # Our cached copy is stale; the next read fetches the winner's version
+            self.version_conflicts += 1
+            self.game_cache.remove(channel_id)
+        return saved
+    
+    async def update_game(self, channel_id, mutate, retries=5):
+        """Apply mutate(game) to the latest stored game and save it, retrying on version conflicts.
+        
+        mutate edits the game in place and may return False to abort. Returns the saved game,
+        or None if the game doesn't exist, the mutation was aborted, or every retry conflicted.
+        """
+        for _ in range(retries):
+            game = await self.get_game(channel_id)
+            if not game:
+                return None
+            game = copy.deepcopy(game)
+            if mutate(game) is False:
+                return None
+            if await self.save_game(channel_id, game):
+                return game
+        print(f"Giving up on saving game {channel_id} after {retries} version conflicts")
+        return None
+    
+    async def set_pending_actions(self, channel_id, pending_actions):
+        """Store a game's pending actions without rewriting the rest of the game"""
+        if self.use_mongo:
+            updated = await self._write_through(channel_id, self.db.set_game_fields(channel_id, {"pending_actions": pending_actions}))
+            self.game_cache.merge(channel_id, updated)
+            return
+        game = self.game_cache.games.get(str(channel_id))
+        if game:
+            game["pending_actions"] = pending_actions
+            game["version"] = game.get("version", 0) + 1
+    
+    async def set_opening_narration(self, channel_id, opening):
+        """Store (or clear, with None) a game's pre-generated opening narration"""
+        if self.use_mongo:
+            updated = await self._write_through(channel_id, self.db.set_game_fields(channel_id, {"opening_narration": opening}))
+            self.game_cache.merge(channel_id, updated)
+            return
+        game = self.game_cache.games.get(str(channel_id))
+        if game:
+            game["opening_narration"] = opening
+            game["version"] = game.get("version", 0) + 1
     
     async def delete_game(self, channel_id):
-        if not self.use_mongo:
-            if str(channel_id) in self.active_games:
-                del self.active_games[str(channel_id)]
-        else:
-            self.games_collection.delete_one({"channel_id": str(channel_id)})
+        self.game_cache.remove(channel_id)
+        if self.use_mongo:
+            await self.db.delete_game(channel_id)
+        self.bot.dispatch("game_updated", str(channel_id))
+    
+    async def get_game_by_ic_channel(self, ic_channel_id):
+        """Find the game whose in-character channel is ic_channel_id"""
+        game = self.game_cache.get_by_ic_channel(ic_channel_id)
+        if game is not None or not self.use_mongo:
+            return game
+        game = await self.db.get_game_by_ic_channel(ic_channel_id)
+        if game:
+            self.game_cache.put(game["channel_id"], game)
+        return game
+    
+    async def get_game_by_ooc_thread(self, ooc_thread_id):
+        """Find the game whose out-of-character thread is ooc_thread_id"""
+        game = self.game_cache.get_by_ooc_thread(ooc_thread_id)
+        if game is not None or not self.use_mongo:
+            return game
+        game = await self.db.get_game_by_ooc_thread(ooc_thread_id)
+        if game:
+            self.game_cache.put(game["channel_id"], game)
+        return game
     
     async def update_character_stats(self, channel_id, player_id, hp_change):
         """Update a character's HP based on narration events."""
-        game = await self.get_game(channel_id)
+        if self.use_mongo:
+            updated = await self._write_through(channel_id, self.db.adjust_character_hp(channel_id, player_id, hp_change))
+            self.game_cache.merge(channel_id, updated)
+            if updated:
+                self.bot.dispatch("game_updated", str(channel_id))
+            return
+        game = self.game_cache.games.get(str(channel_id))
         if not game or player_id not in game["characters"]:
             return
-        character = game["characters"][player_id]
-        character["hp"] = max(0, min(character.get("hp", 20) + hp_change, character["max_hp"]))
-        game["characters"][player_id] = character
-        await self.save_game(channel_id, game)
+        apply_hp_change(game["characters"][player_id], hp_change)
+        game["version"] = game.get("version", 0) + 1
+        self.bot.dispatch("game_updated", str(channel_id))
     
     async def award_exp(self, channel_id, player_id, exp_gain):
         """Award EXP to a character and update level if threshold is met."""
-        game = await self.get_game(channel_id)
+        if self.use_mongo:
+            updated = await self._write_through(channel_id, self.db.add_character_exp(channel_id, player_id, exp_gain))
+            self.game_cache.merge(channel_id, updated)
+            if updated:
+                self.bot.dispatch("game_updated", str(channel_id))
+            return
+        game = self.game_cache.games.get(str(channel_id))
         if not game or player_id not in game["characters"]:
             return
-        character = game["characters"][player_id]
-        character["exp"] = character.get("exp", 0) + exp_gain
-        # Level up: 20 EXP per level (e.g., 20 for level 2, 40 for level 3)
-        current_level = character.get("level", 1)
-        exp_threshold = current_level * 20
-        while character["exp"] >= exp_threshold:
-            character["level"] = current_level + 1
-            current_level = character["level"]
-            exp_threshold = current_level * 20
-        game["characters"][player_id] = character
-        await self.save_game(channel_id, game)
+        apply_exp_gain(game["characters"][player_id], exp_gain)
+        game["version"] = game.get("version", 0) + 1
+        self.bot.dispatch("game_updated", str(channel_id))
+    
+    async def apply_character_deltas(self, channel_id, deltas):
+        """Apply HP and EXP changes to several characters as one game update
+        
+        deltas maps player_id to {"hp": change, "exp": gain}.
+        """
+        if not deltas:
+            return
+        if self.use_mongo:
+            updated = await self._write_through(channel_id, self.db.apply_character_deltas(channel_id, deltas))
+            self.game_cache.merge(channel_id, updated)
+            if updated:
+                self.bot.dispatch("game_updated", str(channel_id))
+            return
+        game = self.game_cache.games.get(str(channel_id))
+        if not game or any(player_id not in game["characters"] for player_id in deltas):
+            return
+        for player_id, delta in deltas.items():
+            if delta.get("hp"):
+                apply_hp_change(game["characters"][player_id], delta["hp"])
+            if delta.get("exp"):
+                apply_exp_gain(game["characters"][player_id], delta["exp"])
+        game["version"] = game.get("version", 0) + 1
+        self.bot.dispatch("game_updated", str(channel_id))
     
     async def add_to_game_history(self, channel_id, entry):
-        game = await self.get_game(channel_id)
+        if self.use_mongo:
+            updated = await self._write_through(channel_id, self.db.push_game_history(channel_id, entry, limit=20))
+            self.game_cache.merge(channel_id, updated)
+            return
+        game = self.game_cache.games.get(str(channel_id))
         if game:
             if "history" not in game:
                 game["history"] = []
             game["history"].append(entry)
             if len(game["history"]) > 20:
                 game["history"] = game["history"][-20:]
-            await self.save_game(channel_id, game)
+            game["version"] = game.get("version", 0) + 1
     
     @commands.command(name="dnd")
     async def dnd_setup(self, ctx):
@@ -294,7 +541,9 @@ class DnDGame(commands.Cog):
                     "combat": {"active": False, "participants": [], "current_turn": 0, "round": 0},
                     "history": []
                 }
-                await self.save_game(channel_id, game_data)
+                if not await self.save_game(channel_id, game_data):
+                    await ctx.send("A D&D game was set up in this channel in the meantime.")
+                    return
                 
                 await ctx.send(embed=success_embed)
                 if is_ai_gm:
@@ -343,11 +592,9 @@ class DnDGame(commands.Cog):
             ic_channel_id = str(ctx.channel.parent_id)
             
             # Find the game where this thread is the OOC thread
-            game = None
-            for stored_game in (self.active_games.values() if not self.use_mongo else self.games_collection.find()):
-                if stored_game.get("ooc_thread_id") == thread_id and stored_game.get("ic_channel_id") == ic_channel_id:
-                    game = stored_game
-                    break
+            game = await self.get_game_by_ooc_thread(thread_id)
+            if game and game.get("ic_channel_id") != ic_channel_id:
+                game = None
             
             if not game:
                 await ctx.send("No active D&D game found associated with this thread.")
@@ -371,10 +618,11 @@ class DnDGame(commands.Cog):
                     await ooc_thread.delete()
             
             await self.delete_game(game["channel_id"])
-            # Delete narration files
-            for file in ["data/narration/world_details.json", "data/narration/npc_database.json", "data/narration/scene_descriptions.json"]:
-                if os.path.exists(file):
-                    os.remove(file)
+            self.active_ic_channels.discard(game.get("ic_channel_id"))
+            # Delete this game's narration data
+            narration = self.bot.get_cog('EmoNarration')
+            if narration and "ic_channel_id" in game:
+                await narration.forget_channel(str(game["ic_channel_id"]))
             await ctx.send("The D&D game has ended. The IC channel, OOC thread, and narration files have been deleted. Thanks for playing!")
         
         else:
@@ -391,12 +639,9 @@ class DnDGame(commands.Cog):
                 await ctx.send("This game has started. Please use `!end_dnd` in the OOC thread to end it.")
                 return
             
+            # Narration is stored per IC channel, so a game that never started has none to delete
             await self.delete_game(channel_id)
-            # Delete narration files
-            for file in ["data/narration/world_details.json", "data/narration/npc_database.json", "data/narration/scene_descriptions.json"]:
-                if os.path.exists(file):
-                    os.remove(file)
-            await ctx.send("The D&D game has been ended before starting. All narration files have been deleted. Thanks for playing!")
+            await ctx.send("The D&D game has been ended before starting. Thanks for playing!")
     
     @commands.command(name="campaign_setup")
     async def campaign_setup(self, ctx):
@@ -460,10 +705,18 @@ class DnDGame(commands.Cog):
             )
             followup_msg = "I’ve sent every player some special choices for their characters. Check them out!!"
             
+            def set_theme(latest):
+                if latest["state"] != "setup":
+                    return False
+                latest["theme"] = theme
+                latest["state"] = "active"
+                latest["last_updated"] = datetime.now().isoformat()
+            
+            if not await self.update_game(channel_id, set_theme):
+                await ctx.send("The campaign was already set up in the meantime.")
+                return
             game["theme"] = theme
             game["state"] = "active"
-            game["last_updated"] = datetime.now().isoformat()
-            await self.save_game(channel_id, game)
             
             await ctx.send(welcome_msg)
             await ctx.send(followup_msg)
@@ -490,7 +743,9 @@ class DnDGame(commands.Cog):
                     await ctx.send(f"Error: Could not find user <@{player_id}>.")
                     continue
                 
-                character = game["characters"][player_id]
+                # Work on a private copy; cached games are shared and must not be edited in place
+                character = copy.deepcopy(game["characters"][player_id])
+                original_character = copy.deepcopy(character)
                 race_key = race_mapping.get(character["race"].split()[0], character["race"])
                 if race_key not in RACES:
                     await ctx.send(f"Error: Invalid race '{character['race']}' for <@{player_id}>.")
@@ -672,14 +927,20 @@ class DnDGame(commands.Cog):
                         intro_msg = f"Your spells for {character['name']} are set!"
                         await player.send(intro_msg, embed=spells_embed)
                 
-                game["characters"][player_id] = character
-                await self.save_game(channel_id, game)
+                # Merge only the fields chosen here, so concurrent writes to the game aren't clobbered
+                chosen_fields = {key: value for key, value in character.items() if original_character.get(key) != value}
+                await self.update_game(
+                    channel_id,
+                    lambda latest: latest["characters"].setdefault(player_id, {}).update(chosen_fields)
+                )
                 await player.send(intro_msg, embed=char_embed)
                 await ctx.send(f"Player <@{player_id}> completed the special choices for their character.")
                 completed_players.add(player_id)
             
             if len(completed_players) == len(game["player_ids"]):
                 await ctx.send("Now players use `!start` to begin this adventure!")
+                # The party is final, so the opening narration can be prepared before anyone asks for it
+                self.bot.dispatch("campaign_ready", channel_id)
             
             await self.add_to_game_history(channel_id, {
                 "event": "campaign_theme_set",
@@ -742,11 +1003,24 @@ class DnDGame(commands.Cog):
         )
         
         # Update game data
-        game["ic_channel_id"] = str(ic_channel.id)
-        game["ooc_thread_id"] = str(ooc_thread.id)
-        game["state"] = "started"
-        game["last_updated"] = datetime.now().isoformat()
-        await self.save_game(channel_id, game)
+        def mark_started(latest):
+            # Another !start may have won the race, or the game may have been ended meanwhile
+            if latest.get("state") != "active":
+                return False
+            latest["ic_channel_id"] = str(ic_channel.id)
+            latest["ooc_thread_id"] = str(ooc_thread.id)
+            latest["state"] = "started"
+            latest["last_updated"] = datetime.now().isoformat()
+        
+        if not await self.update_game(channel_id, mark_started):
+            # Deleting the IC channel removes the OOC thread with it
+            try:
+                await ic_channel.delete()
+            except Exception as e:
+                print(f"Error deleting IC channel {ic_channel.id} after a failed start: {e}")
+            await ctx.send("The game couldn’t be started because it was changed or ended meanwhile. Please try `!start` again.")
+            return
+        self.active_ic_channels.add(str(ic_channel.id))
         
         # Notify in original channel and new IC channel
         await ctx.send(f"The adventure begins! Join the private channel {ic_channel.mention} for in-character play. Use the thread {ooc_thread.mention} for out-of-character chat.")
@@ -769,12 +1043,9 @@ class DnDGame(commands.Cog):
         parent_channel_id = str(ctx.channel.parent_id) if isinstance(ctx.channel, discord.Thread) else None
         
         # Find the game where this is the OOC thread or IC channel
-        game = None
-        for stored_game in (self.active_games.values() if not self.use_mongo else self.games_collection.find()):
-            if (stored_game.get("ooc_thread_id") == channel_id or
-                (parent_channel_id and stored_game.get("ic_channel_id") == parent_channel_id)):
-                game = stored_game
-                break
+        game = await self.get_game_by_ooc_thread(channel_id)
+        if not game and parent_channel_id:
+            game = await self.get_game_by_ic_channel(parent_channel_id)
         
         if not game:
             await ctx.send("There is no active D&D game associated with this channel or thread.")
@@ -856,9 +1127,13 @@ class DnDGame(commands.Cog):
         )
         
         await ctx.send(embed=embed)
-    def cog_unload(self):
-        if self.use_mongo:
-            self.mongo_client.close()
+    
+    def get_stats(self):
+        """Counters shown by the !stats command"""
+        return {
+            "game_cache": self.game_cache.stats(),
+            "games": {"version_conflicts": self.version_conflicts}
+        }
 
 async def setup(bot):
     await bot.add_cog(DnDGame(bot))
\ No newline at end of file
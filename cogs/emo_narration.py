@@ -1,62 +1,395 @@
 import discord
 from discord.ext import commands
 import asyncio
-import json
 import random
 import os
 import time
 import re
+import hashlib
+from datetime import datetime
+from collections import deque
+from gemini_client import estimate_tokens
+from narration_store import NarrationStore
+from narration_parser import parse_narration, parse_structured_narration, ParsedNarration, NARRATION_SCHEMA
+
+# Tags Emo uses to annotate narration; each runs to the end of its line and is stripped before display
+NARRATION_TAGS = ("SCENE:", "NPC:", "PENDING_ROLL:")
+COMPLETE_TAG_LINE = re.compile(r"(?:SCENE|NPC|PENDING_ROLL):[^\n]*\n")
+OPEN_TAG_LINE = re.compile(r"(?:SCENE|NPC|PENDING_ROLL):[^\n]*$")
+TRAILING_WORD = re.compile(r"(?:^|(?<=\s))([A-Z_]+)$")
+
+def visible_narration(text):
+    """Return the part of a partially streamed narration that is safe to show
+
+    Complete tag lines are dropped, and a tag still being written (or a trailing word
+    that could become one) is held back until the next newline shows where it ends.
+    """
+    open_tag = OPEN_TAG_LINE.search(text)
+    if open_tag:
+        text = text[:open_tag.start()]
+    trailing = TRAILING_WORD.search(text)
+    if trailing and any(tag.startswith(trailing.group(1)) for tag in NARRATION_TAGS):
+        text = text[:trailing.start(1)]
+    return COMPLETE_TAG_LINE.sub("", text).strip()
+
+# Storytelling system prompt, set as the narration model's system instruction
+NARRATION_SYSTEM_PROMPT = """You are Emo, a skilled and engaging Dungeon Master for a D&D adventure. Follow these storytelling guidelines:
+
+1. Begin with a brief, vivid scene description (2-3 lines) that helps players visualize where they are
+2. Use simple, everyday language that beginners can easily understand
+3. Introduce characters naturally, mentioning one interesting visual detail about each
+4. Present clear choices or opportunities for players without overwhelming them
+5. Only ask for dice rolls when truly necessary (major challenges, combat, or risky actions)
+6. When describing actions, focus on what players see, hear, and feel
+7. Create a sense of wonder and adventure appropriate for the theme
+8. Include occasional NPC interactions with distinct personalities
+9. Gently remind players of their character abilities when relevant
+10. Keep your narration under 7 lines for good pacing
+
+Special tags (these won't appear in the final text):
+- Use SCENE: tag to mark important location descriptions
+- Use NPC: Name: Description to track important non-player characters
+- If a dice roll is needed, include PENDING_ROLL: [character] must roll [dice] + [modifier] and explain why in everyday terms
+"""
+
+class NarrationStream:
+    """Fills an adventure embed progressively while a narration streams in
+
+    Edits are coalesced to one per edit_interval to stay under Discord's edit rate limit.
+    """
+    def __init__(self, message, embed, edit_interval):
+        self.message = message
+        self.embed = embed
+        self.edit_interval = edit_interval
+        self.last_edit = 0  # The first text is shown as soon as it arrives
+        self.shown = None
+
+    async def update(self, text):
+        if time.monotonic() - self.last_edit < self.edit_interval:
+            return
+        visible = visible_narration(text)[:4000]
+        if visible and visible != self.shown:
+            self.embed.description = visible + " ▌"
+            await self.message.edit(embed=self.embed)
+            self.shown = visible
+        self.last_edit = time.monotonic()
+
+    async def finish(self, narration):
+        """Replace the streamed text with the final, fully processed narration"""
+        self.embed.description = narration
+        await self.message.edit(embed=self.embed)
+
+# System instruction for the JSON narration mode, where the response schema replaces the special tags
+NARRATION_JSON_PROMPT = NARRATION_SYSTEM_PROMPT + """
+Instead of the special tags, reply with JSON matching the response schema: the story goes in "narration",
+the location description in "scene", new NPCs in "npcs", needed dice rolls in "rolls", and any HP lost
+(negative) or healed (positive) and EXP gained by a character in "character_changes".
+"""
+
+# Request for the first scene of an adventure
+OPENING_PROMPT = "Start the adventure for the party. Create a beginner-friendly opening scene that introduces a simple goal or quest. Tag the scene description with SCENE: and any NPCs with NPC: tags. Use everyday language a new player would understand."
+# The same request in JSON mode, where the scene and NPCs go in their own fields instead of tags
+OPENING_JSON_PROMPT = "Start the adventure for the party. Create a beginner-friendly opening scene that introduces a simple goal or quest. Put the scene description in \"scene\" and any NPCs in \"npcs\". Use everyday language a new player would understand."
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers with the same key share its result"""
+    def __init__(self):
+        self.calls = {}
+        self.suppressed = 0
+
+    async def run(self, key, make_call):
+        """Return (result, shared), where shared is True if the result came from a call already in flight"""
+        task = self.calls.get(key)
+        if task is not None:
+            self.suppressed += 1
+            return await asyncio.shield(task), True
+        task = asyncio.ensure_future(make_call())
+        self.calls[key] = task
+
+        def forget(done):
+            if self.calls.get(key) is done:
+                del self.calls[key]
+        task.add_done_callback(forget)
+        # Shielded, so the leader being cancelled doesn't cancel the call others are waiting on
+        return await asyncio.shield(task), False
+
+class PromptContextCache:
+    """Compiled narration prompt context per IC channel
+
+    The roster blocks (character sheets and party status, per game) and the world block
+    (scene, NPCs and world details, per IC channel) are built once and reused until a
+    write bumps their content version.
+    """
+    def __init__(self):
+        # ic_channel_id -> {"game_channel_id", "roster_version", "roster", "world_version", "world", "context"}
+        self.entries = {}
+        self.roster_versions = {}  # game channel_id -> content version
+        self.world_versions = {}  # ic_channel_id -> content version
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.build_seconds = 0.0
+
+    def invalidate_roster(self, game_channel_id):
+        self.roster_versions[game_channel_id] = self.roster_versions.get(game_channel_id, 0) + 1
+
+    def invalidate_world(self, ic_channel_id):
+        self.world_versions[ic_channel_id] = self.world_versions.get(ic_channel_id, 0) + 1
+
+    def discard(self, ic_channel_id):
+        self.entries.pop(ic_channel_id, None)
+        self.world_versions.pop(ic_channel_id, None)
+
+    def get(self, ic_channel_id, game, build_roster, build_world):
+        """Return the compiled (stable, live) context, rebuilding only the blocks whose content version moved
+
+        build_roster returns the (character sheets, party status) pair; the live part is the
+        party status plus the world block.
+        """
+        game_channel_id = str(game["channel_id"])
+        roster_version = self.roster_versions.get(game_channel_id, 0)
+        world_version = self.world_versions.get(ic_channel_id, 0)
+        entry = self.entries.get(ic_channel_id)
+        if entry and entry["game_channel_id"] != game_channel_id:
+            entry = None  # The channel now belongs to a different game
+        if entry and entry["roster_version"] == roster_version and entry["world_version"] == world_version:
+            self.hits += 1
+            return entry["context"]
+        
+        self.misses += 1
+        start = time.perf_counter()
+        roster = entry["roster"] if entry and entry["roster_version"] == roster_version else build_roster(game)
+        world = entry["world"] if entry and entry["world_version"] == world_version else build_world(ic_channel_id)
+        sheets, status = roster
+        context = (sheets, "\n\n".join(block for block in (status, world) if block))
+        self.entries[ic_channel_id] = {
+            "game_channel_id": game_channel_id,
+            "roster_version": roster_version,
+            "roster": roster,
+            "world_version": world_version,
+            "world": world,
+            "context": context
+        }
+        self.builds += 1
+        self.build_seconds += time.perf_counter() - start
+        return context
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "builds": self.builds,
+            "avg_build_ms": round(self.build_seconds * 1000 / self.builds, 3) if self.builds else 0.0
+        }
 
 class EmoNarration(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.gemini_chat = None
-        self.game_histories = {}  # Store chat history per IC channel
+        self.game_histories = {}  # Recent turns kept verbatim per IC channel
+        self.history_summaries = {}  # Running summary of older turns per IC channel
+        self.summary_tasks = {}  # Background summarizations in progress per IC channel
+        self.prompt_contexts = PromptContextCache()  # Compiled roster and world blocks per IC channel
+        self.history_token_budget = int(os.getenv('NARRATION_HISTORY_TOKENS', 3000))
+        self.history_turns = int(os.getenv('NARRATION_HISTORY_TURNS', 6))
+        # Ask Gemini for JSON narrations with explicit state changes instead of scraping tags from text
+        self.structured_output = os.getenv('NARRATION_JSON_MODE', 'false').lower() == 'true'
+        # Stream narrations into their embed as they are generated (independent of !ask streaming)
+        self.stream_narration = os.getenv('NARRATION_STREAM', 'true').lower() != 'false'
         self.pending_actions = {}  # Store pending actions (e.g., dice rolls) per IC channel
         self.world_details = {}    # Store world building elements
         self.scene_descriptions = {}  # Store current scene descriptions
         self.npc_database = {}     # Store NPCs the party has encountered
+        self.fast_path_rejections = 0  # Replies ignored by the IC channel set lookup
+        self.narration_message_ids = {}  # Recent narration message IDs per IC channel
+        self.reply_fetches = 0  # Replies that needed a REST fetch to find their target
+        
+        # Replies within the batching window are merged into one turn; turns run one at a time per channel
+        self.batch_window = float(os.getenv('NARRATION_BATCH_WINDOW', 2.0))
+        self.action_batches = {}  # Actions waiting for the next turn per IC channel
+        self.turn_tasks = {}  # Scheduled turn per IC channel
+        self.turn_locks = {}  # Serializes openings and turns per IC channel
+        self.turns = 0
+        self.batched_actions = 0
         
-        # Path for storing persistent data
-        self.data_folder = "./data/narration"
-        os.makedirs(self.data_folder, exist_ok=True)
+        # Duplicate !emo calls and double-sent replies share the narration already in flight
+        self.openings = SingleFlight()  # Opening narration per IC channel
+        self.in_flight_actions = {}  # (player ID, normalized text) queued or being narrated per IC channel
+        self.duplicate_actions = 0
+        
+        # Openings pre-generated after campaign setup
+        self.openings_pregenerated = 0
+        self.pregenerated_openings_used = 0
+        self.stale_openings = 0  # Stored openings skipped because the roster changed
+        
+        # Narration state is saved per IC channel, shortly after it changes
+        self.narration_store = NarrationStore(
+            "./data/narration",
+            self.channel_state,
+            delay=float(os.getenv('NARRATION_SAVE_DELAY', 5.0))
+        )
         
         # Load previous data if available
         self.load_persistent_data()
 
     def load_persistent_data(self):
-        """Load persistent storytelling data from files."""
-        try:
-            world_path = os.path.join(self.data_folder, "world_details.json")
-            if os.path.exists(world_path):
-                with open(world_path, 'r') as f:
-                    self.world_details = json.load(f)
-                    
-            npc_path = os.path.join(self.data_folder, "npc_database.json")
-            if os.path.exists(npc_path):
-                with open(npc_path, 'r') as f:
-                    self.npc_database = json.load(f)
-                    
-            scenes_path = os.path.join(self.data_folder, "scene_descriptions.json")
-            if os.path.exists(scenes_path):
-                with open(scenes_path, 'r') as f:
-                    self.scene_descriptions = json.load(f)
-        except Exception as e:
-            print(f"Error loading narration data: {e}")
+        """Load each IC channel's storytelling data from its file."""
+        for channel_id, state in self.narration_store.load_all().items():
+            if state.get("world_details"):
+                self.world_details[channel_id] = state["world_details"]
+            if state.get("scene"):
+                self.scene_descriptions[channel_id] = state["scene"]
+            if state.get("npcs"):
+                self.npc_database[channel_id] = state["npcs"]
+            if state.get("turns"):
+                self.game_histories[channel_id] = state["turns"]
+            if state.get("summary"):
+                self.history_summaries[channel_id] = state["summary"]
 
-    def save_persistent_data(self):
-        """Save storytelling data to persist between bot restarts."""
+    def channel_state(self, ic_channel_id):
+        """Copy of one channel's storytelling data for the store to write, or None once it's gone"""
+        state = {
+            "world_details": self.world_details.get(ic_channel_id),
+            "scene": self.scene_descriptions.get(ic_channel_id),
+            "npcs": dict(self.npc_database.get(ic_channel_id, {})),
+            "summary": self.history_summaries.get(ic_channel_id, ""),
+            "turns": list(self.game_histories.get(ic_channel_id, []))
+        }
+        if not any(state.values()):
+            return None
+        return state
+
+    async def forget_channel(self, ic_channel_id):
+        """Drop an ended game's storytelling data, in memory and on disk"""
+        task = self.summary_tasks.pop(ic_channel_id, None)
+        if task:
+            task.cancel()
+        for store in (self.world_details, self.scene_descriptions, self.npc_database,
+                      self.game_histories, self.history_summaries, self.pending_actions):
+            store.pop(ic_channel_id, None)
+        self.prompt_contexts.discard(ic_channel_id)
+        if self.gemini_chat and self.gemini_chat.context_cache:
+            await self.gemini_chat.context_cache.discard(f"narration:{ic_channel_id}")
+        await self.narration_store.delete(ic_channel_id)
+
+    async def cog_unload(self):
+        """Stop background work and write any unsaved narration data before shutdown"""
+        for task in list(self.turn_tasks.values()) + list(self.summary_tasks.values()):
+            task.cancel()
+        await self.narration_store.close()
+
+    def history_for_prompt(self, ic_channel_id):
+        """Gemini history for a turn: the running summary, then the latest turns that fit the token budget"""
+        window = self.game_histories.get(ic_channel_id, [])
+        summary = self.history_summaries.get(ic_channel_id)
+        budget = self.history_token_budget - (estimate_tokens(summary) if summary else 0)
+        
+        # Walk back over whole turns (user + model pairs), always keeping the latest one.
+        # Turns waiting on a slow or failed summarization are dropped here, so prompts stay bounded.
+        start = len(window)
+        while start >= 2:
+            cost = estimate_tokens(window[start - 2]["content"]) + estimate_tokens(window[start - 1]["content"])
+            if cost > budget and start < len(window):
+                break
+            budget -= cost
+            start -= 2
+        
+        history = []
+        if summary:
+            history.append({"role": "user", "parts": [{"text": f"Summary of the adventure so far:\n{summary}"}]})
+            history.append({"role": "model", "parts": [{"text": "Got it, I'll continue the story from there."}]})
+        history += [{"role": entry["role"], "parts": [{"text": entry["content"]}]} for entry in window[start:]]
+        return history
+
+    def history_needs_fold(self, ic_channel_id):
+        """Whether the window has grown far enough past its limits to be worth a summarization call
+
+        Folding starts at twice the turn limit or 1.5 times the token budget and then goes well
+        below both (see history_overflow), so summaries stay occasional instead of running
+        on every turn. Until then history_for_prompt keeps prompts within the budget.
+        """
+        window = self.game_histories.get(ic_channel_id, [])
+        if len(window) >= self.history_turns * 4:
+            return True
+        return sum(estimate_tokens(entry["content"]) for entry in window) > self.history_token_budget * 1.5
+
+    def history_overflow(self, ic_channel_id):
+        """Number of entries at the start of the window to fold into the summary
+
+        What remains is at most the turn limit and half the token budget, but the latest
+        turn always stays verbatim.
+        """
+        window = self.game_histories.get(ic_channel_id, [])
+        overflow = max(len(window) - self.history_turns * 2, 0)
+        
+        tokens = sum(estimate_tokens(entry["content"]) for entry in window[overflow:])
+        while tokens > self.history_token_budget / 2 and overflow < len(window) - 2:
+            tokens -= estimate_tokens(window[overflow]["content"]) + estimate_tokens(window[overflow + 1]["content"])
+            overflow += 2
+        return overflow
+
+    def record_turn(self, ic_channel_id, user_prompt, narration):
+        """Append a turn to the channel's window and start folding older turns if it grew too large"""
+        window = self.game_histories.setdefault(ic_channel_id, [])
+        window.append({"role": "user", "content": user_prompt})
+        window.append({"role": "model", "content": narration})
+        self.narration_store.mark_dirty(ic_channel_id)
+        
+        if ic_channel_id not in self.summary_tasks and self.history_needs_fold(ic_channel_id):
+            # Summarizing costs a Gemini call, so it runs after the narration is already on its way
+            self.summary_tasks[ic_channel_id] = asyncio.create_task(self.fold_history(ic_channel_id))
+
+    async def fold_history(self, ic_channel_id):
+        """Fold turns that fell out of the verbatim window into the channel's running summary"""
         try:
-            with open(os.path.join(self.data_folder, "world_details.json"), 'w') as f:
-                json.dump(self.world_details, f)
-                
-            with open(os.path.join(self.data_folder, "npc_database.json"), 'w') as f:
-                json.dump(self.npc_database, f)
-                
-            with open(os.path.join(self.data_folder, "scene_descriptions.json"), 'w') as f:
-                json.dump(self.scene_descriptions, f)
+            overflow = self.history_overflow(ic_channel_id)
+            folded = self.game_histories[ic_channel_id][:overflow]
+            if not folded:
+                return  # Only the latest turn is left, and it always stays verbatim
+            summary = await self.gemini_chat.client.summarize(
+                self.gemini_chat.get_model(),
+                folded,
+                self.history_summaries.get(ic_channel_id, ""),
+                subject="D&D adventure"
+            )
+            
+            # Only new turns are appended meanwhile, but the channel may have been reset
+            window = self.game_histories.get(ic_channel_id)
+            if window is None or window[:overflow] != folded:
+                return
+            self.history_summaries[ic_channel_id] = summary
+            del window[:overflow]
+            self.narration_store.mark_dirty(ic_channel_id)
         except Exception as e:
-            print(f"Error saving narration data: {e}")
+            print(f"Error summarizing narration history: {e}")
+        finally:
+            self.summary_tasks.pop(ic_channel_id, None)
+
+    def remember_narration(self, message):
+        """Track a narration message Emo posted so replies to it are recognized without HTTP"""
+        channel_id = str(message.channel.id)
+        if channel_id not in self.narration_message_ids:
+            self.narration_message_ids[channel_id] = deque(maxlen=50)
+        self.narration_message_ids[channel_id].append(message.id)
+
+    async def is_reply_to_emo(self, message):
+        """Check whether a reply targets one of Emo's messages, avoiding fetch_message when possible"""
+        reference = message.reference
+        if reference.message_id in self.narration_message_ids.get(str(message.channel.id), ()):
+            return True
+
+        # Discord usually sends the replied-to message along, otherwise try the client cache
+        replied_msg = reference.resolved or reference.cached_message
+        if isinstance(replied_msg, discord.DeletedReferencedMessage):
+            return False
+        if replied_msg is None:
+            self.reply_fetches += 1
+            try:
+                replied_msg = await message.channel.fetch_message(reference.message_id)
+            except discord.NotFound:
+                return False
+        return replied_msg.author == self.bot.user
 
     async def setup_gemini_chat(self):
         if not self.gemini_chat:
@@ -67,107 +400,274 @@ class EmoNarration(commands.Cog):
                 print("WARNING: GeminiChat cog loaded but has no model attribute.")
 
     async def save_pending_action(self, ic_channel_id, action_data):
-        dnd_game = self.bot.get_cog('DnDGame')
-        if dnd_game and dnd_game.use_mongo:
-            await dnd_game.save_game(ic_channel_id, {"pending_actions": self.pending_actions.get(ic_channel_id, {})})
         # Always update in-memory regardless of MongoDB
         if ic_channel_id not in self.pending_actions:
             self.pending_actions[ic_channel_id] = {}
         self.pending_actions[ic_channel_id].update(action_data)
+        dnd_game = self.bot.get_cog('DnDGame')
+        if dnd_game and dnd_game.use_mongo:
+            # Field-level write, so it can't clobber concurrent changes to the rest of the game
+            game = await dnd_game.get_game_by_ic_channel(ic_channel_id)
+            if game:
+                await dnd_game.set_pending_actions(game["channel_id"], self.pending_actions[ic_channel_id])
 
-    async def extract_narrative_elements(self, narration, ic_channel_id):
-        """Extract world building elements from the narration to maintain consistency."""
-        # Simple extraction of location descriptions
-        if "SCENE:" in narration:
-            scene_match = re.search(r"SCENE: (.+?)(?=\n|$)", narration)
-            if scene_match:
-                self.scene_descriptions[ic_channel_id] = scene_match.group(1)
-                narration = narration.replace(scene_match.group(0), "")
-                
-        # Extract NPC introductions
-        if "NPC:" in narration:
-            npc_matches = re.findall(r"NPC: ([^:]+): (.+?)(?=\n|$)", narration)
-            if npc_matches:
-                if ic_channel_id not in self.npc_database:
-                    self.npc_database[ic_channel_id] = {}
-                    
-                for npc_name, npc_desc in npc_matches:
-                    self.npc_database[ic_channel_id][npc_name.strip()] = npc_desc.strip()
-                    narration = narration.replace(f"NPC: {npc_name}: {npc_desc}", "")
-                
-        # Save updated data
-        self.save_persistent_data()
-        return narration.strip()
+    async def extract_narrative_elements(self, narration, ic_channel_id, structured=False):
+        """Extract world building elements from the narration to maintain consistency.
+        
+        structured narrations are JSON responses. Returns the parsed narration; its
+        other events are applied by apply_narration_events.
+        """
+        parsed = parse_structured_narration(narration) if structured else parse_narration(narration)
+        world_changed = False
+        for event in parsed.events:
+            if event.kind == "scene":
+                self.scene_descriptions[ic_channel_id] = event.value
+                world_changed = True
+            elif event.kind == "npc":
+                self.npc_database.setdefault(ic_channel_id, {})[event.name] = event.value
+                world_changed = True
+        if world_changed:
+            self.prompt_contexts.invalidate_world(ic_channel_id)
+            self.narration_store.mark_dirty(ic_channel_id)
+        return parsed
+
+    async def apply_narration_events(self, ic_channel_id, game, events):
+        """Apply HP, EXP and roll events for any named character, returning lines to append to the narration"""
+        dnd_game = self.bot.get_cog('DnDGame')
+        # Narrations name characters by any part of their name ("Roland" for "Sir Roland",
+        # and stat phrases only capture the word before them, "Lynn" for "Aria-Lynn").
+        # Full names always match; a name part only when no other character shares it.
+        characters = {}
+        name_parts = {}
+        for pid, char in game.get("characters", {}).items():
+            name = char.get("name")
+            if name:
+                characters.setdefault(name.lower(), (pid, name))
+                for part in set(re.findall(r"\w+", name.lower())):
+                    name_parts.setdefault(part, []).append((pid, name))
+        for part, owners in name_parts.items():
+            if len(owners) == 1:
+                characters.setdefault(part, owners[0])
+        
+        # Stats live on the game's setup channel document; all changes go out as one update
+        deltas = {}
+        rolls = {}
+        lines = []
+        for event in events:
+            if event.kind == "roll":
+                # Pending rolls are keyed by the character's full name, like the players' actions
+                char_name = characters.get(event.name.lower(), (None, event.name))[1]
+                rolls[char_name] = f"roll {event.value}"
+                continue
+            if event.kind not in ("hp", "exp") or event.name.lower() not in characters:
+                continue
+            player_id, char_name = characters[event.name.lower()]
+            delta = deltas.setdefault(player_id, {"hp": 0, "exp": 0})
+            delta[event.kind] += event.value
+            if event.kind == "exp":
+                lines.append(f"{char_name} gained {event.value} EXP!")
+            elif event.value < 0:
+                lines.append(f"{char_name}'s HP decreased by {-event.value}!")
+            else:
+                lines.append(f"{char_name}'s HP increased by {event.value}!")
+        if deltas and dnd_game:
+            await dnd_game.apply_character_deltas(game["channel_id"], deltas)
+        if rolls:
+            await self.save_pending_action(ic_channel_id, rolls)
+        return lines
+
+    def narration_stream_enabled(self):
+        # JSON narrations can't be shown until they are complete
+        if not self.stream_narration or self.structured_output:
+            return False
+        return bool(self.gemini_chat and getattr(self.gemini_chat, 'model', None))
 
-    async def get_gemini_response(self, system_prompt, user_prompt, ic_channel_id):
+    async def open_narration_stream(self, send, title):
+        """Post the adventure embed that a streamed narration will fill in, or None when not streaming"""
         await self.setup_gemini_chat()
-        if not self.gemini_chat or not hasattr(self.gemini_chat, 'model') or not self.gemini_chat.model:
-            return "Sorry, my narration brain isn't working! Check if GEMINI_API_KEY is set in .env."
+        if not self.narration_stream_enabled():
+            return None
+        embed = discord.Embed(title=title, description="…", color=0x1E90FF)  # Dodger Blue
+        embed.set_footer(text="Reply to this message to interact with the world")
+        message = await send(embed=embed)
+        return NarrationStream(message, embed, self.gemini_chat.stream_edit_interval)
+
+    def party_context(self, game, ic_channel_id):
+        """(stable, live) prompt context, never copied into the history
+
+        The stable part (theme and character sheets) rarely changes, so it can lead the history
+        and be cached. The live part (HP, levels and world state) changes most turns and is sent
+        with each request instead.
+        """
+        return self.prompt_contexts.get(
+            ic_channel_id,
+            game,
+            lambda game: (self.build_roster_block(game), self.build_status_block(game)),
+            self.build_world_block
+        )
+
+    def context_turns(self, context):
+        """History turns that hand the party's character sheets to the model"""
+        return [
+            {"role": "user", "parts": [{"text": context}]},
+            {"role": "model", "parts": [{"text": "Got it, I know the party."}]}
+        ]
+
+    def roster_signature(self, game):
+        """Fingerprint of everything the roster blocks show, to tell whether a stored opening still fits"""
+        return hashlib.sha256(f"{self.build_roster_block(game)}\n{self.build_status_block(game)}".encode()).hexdigest()
+
+    def build_roster_block(self, game):
+        character_details = []
+        for pid in game["player_ids"]:
+            char = game["characters"].get(pid, {})
+            name = char.get("name", "Unknown")
+            race = char.get("race", "Unknown")
+            char_class = char.get("class", "Unknown")
+            spells = ", ".join(char.get("spells", [])) or "None"
+            skills = ", ".join(char.get("skills", [])) or "None"
+            traits = ", ".join(char.get("traits", [])) or "None"
+            equipment = ", ".join(char.get("equipment", [])) or "None"
+            character_details.append(f"- {name} (Race: {race}, Class: {char_class}, Spells: {spells}, Skills: {skills}, Traits: {traits}, Equipment: {equipment})")
+        return f"This is a {game['theme']} adventure. The party's characters:\n" + "\n".join(character_details)
+
+    def build_status_block(self, game):
+        status = []
+        for pid in game["player_ids"]:
+            char = game["characters"].get(pid, {})
+            status.append(f"- {char.get('name', 'Unknown')}: Level {char.get('level', 1)}, HP {char.get('hp', 20)}/{char.get('max_hp', 20)}")
+        return "Current party status:\n" + "\n".join(status)
+
+    def build_world_block(self, ic_channel_id):
+        # Add context from saved world details
+        context_info = []
+        
+        # Add current scene
+        if ic_channel_id in self.scene_descriptions:
+            context_info.append(f"Current scene: {self.scene_descriptions[ic_channel_id]}")
+            
+        # Add NPCs the party has met
+        if ic_channel_id in self.npc_database and self.npc_database[ic_channel_id]:
+            npc_info = "\nNPCs the party has encountered:\n"
+            for name, desc in self.npc_database[ic_channel_id].items():
+                npc_info += f"- {name}: {desc}\n"
+            context_info.append(npc_info)
+            
+        # Add general world details
+        if ic_channel_id in self.world_details:
+            context_info.append(f"World details: {self.world_details[ic_channel_id]}")
+            
+        if not context_info:
+            return ""
+        return "Context (not to be repeated verbatim):\n" + "\n".join(context_info)
+
+    @commands.Cog.listener()
+    async def on_campaign_ready(self, channel_id):
+        """Pre-generate a campaign's opening narration in the background once its party is final"""
+        await self.setup_gemini_chat()
+        dnd_game = self.bot.get_cog('DnDGame')
+        if not dnd_game or not self.gemini_chat or not getattr(self.gemini_chat, 'model', None):
+            return
         try:
-            # Use existing history or start fresh
-            if ic_channel_id not in self.game_histories:
-                self.game_histories[ic_channel_id] = []
+            game = await dnd_game.get_game(channel_id)
+            if not game or not game.get("is_ai_gm"):
+                return
+            # There is no IC channel or world state yet, so the roster alone is the context
+            model = self.gemini_chat.get_model(NARRATION_SYSTEM_PROMPT)
+            context = f"{self.build_roster_block(game)}\n\n{self.build_status_block(game)}"
+            # Fingerprint the party the prompt was built from; it may change while Gemini writes
+            roster_signature = self.roster_signature(game)
+            chat = model.start_chat(history=self.context_turns(context))
+            response = await self.gemini_chat.client.send_message(chat, OPENING_PROMPT)
             
+            # Too late if someone already got a live opening in the meantime
+            game = await dnd_game.get_game(channel_id)
+            if not game or self.game_histories.get(game.get("ic_channel_id")):
+                return
+            await dnd_game.set_opening_narration(channel_id, {
+                "text": response.text,
+                "roster_signature": roster_signature,
+                "created_at": datetime.now().isoformat()
+            })
+            self.openings_pregenerated += 1
+            print(f"Pre-generated the opening narration for game {channel_id}")
+        except Exception as e:
+            print(f"Error pre-generating opening narration: {e}")
+
+    @commands.Cog.listener()
+    async def on_game_updated(self, channel_id):
+        """A game's characters or settings changed, so its compiled roster is stale"""
+        self.prompt_contexts.invalidate_roster(channel_id)
+
+    async def get_gemini_response(self, user_prompt, ic_channel_id, game, stream=None):
+        """Narrate a turn and return it parsed into display text and events"""
+        await self.setup_gemini_chat()
+        if not self.gemini_chat or not hasattr(self.gemini_chat, 'model') or not self.gemini_chat.model:
+            return ParsedNarration("Sorry, my narration brain isn't working! Check if GEMINI_API_KEY is set in .env.", [])
+        try:
             # Load pending actions from MongoDB if available
             dnd_game = self.bot.get_cog('DnDGame')
             if dnd_game and dnd_game.use_mongo:
-                game = await dnd_game.get_game(ic_channel_id)
-                if game and "pending_actions" in game:
-                    self.pending_actions[ic_channel_id] = game["pending_actions"]
+                game = await dnd_game.get_game_by_ic_channel(ic_channel_id) or game
+                if "pending_actions" in game:
+                    self.pending_actions[ic_channel_id] = dict(game["pending_actions"])
             
-            # Convert history to Gemini format with roles
-            history = [{"role": "user" if i % 2 == 0 else "model", "parts": [{"text": entry["content"]}]}
-                      for i, entry in enumerate(self.game_histories[ic_channel_id])]
+            # Character sheets lead the history, followed by the summary and recent turns
+            stable, live = self.party_context(game, ic_channel_id)
+            prefix = self.context_turns(stable)
+            history = self.history_for_prompt(ic_channel_id)
             
-            # Add context from saved world details
-            context_info = []
+            # JSON mode swaps the tag instructions for a response schema
+            if self.structured_output:
+                system_instruction, response_schema = NARRATION_JSON_PROMPT, NARRATION_SCHEMA
+            else:
+                system_instruction, response_schema = NARRATION_SYSTEM_PROMPT, None
             
-            # Add current scene
-            if ic_channel_id in self.scene_descriptions:
-                context_info.append(f"Current scene: {self.scene_descriptions[ic_channel_id]}")
-                
-            # Add NPCs the party has met
-            if ic_channel_id in self.npc_database and self.npc_database[ic_channel_id]:
-                npc_info = "\nNPCs the party has encountered:\n"
-                for name, desc in self.npc_database[ic_channel_id].items():
-                    npc_info += f"- {name}: {desc}\n"
-                context_info.append(npc_info)
-                
-            # Add general world details
-            if ic_channel_id in self.world_details:
-                context_info.append(f"World details: {self.world_details[ic_channel_id]}")
-                
-            # Add context to user prompt
-            if context_info:
-                context_str = "\n\nContext (not to be repeated verbatim):\n" + "\n".join(context_info)
-                user_prompt += context_str
+            # With context caching the system prompt and character sheets are registered once per party
+            model = None
+            if self.gemini_chat.context_cache:
+                model = await self.gemini_chat.context_cache.get_model(
+                    f"narration:{ic_channel_id}",
+                    system_instruction,
+                    prefix,
+                    self.gemini_chat.generation_config_for(response_schema)
+                )
+            if model is None:
+                # The storytelling prompt is the model's system instruction, so a turn costs one request
+                model = self.gemini_chat.get_model(system_instruction, response_schema)
+                history = prefix + history
             
-            # Append pending actions to user_prompt for context
+            # Party status, world state and pending actions change most turns, so they ride on the
+            # request rather than the (cacheable) history
+            request_text = f"{live}\n\n{user_prompt}" if live else user_prompt
             pending = self.pending_actions.get(ic_channel_id, {})
             if pending:
                 pending_str = "; ".join([f"{char}: {action}" for char, action in pending.items()])
-                user_prompt += f"\nPending actions: {pending_str}"
-            
-            chat = self.gemini_chat.model.start_chat(history=history)
+                request_text += f"\nPending actions: {pending_str}"
             
-            # Send system prompt first
-            await asyncio.to_thread(chat.send_message, {"role": "user", "parts": [{"text": system_prompt}]})
+            chat = model.start_chat(history=history)
             
-            # Then send the user prompt and get response
-            response = await asyncio.to_thread(chat.send_message, {"role": "user", "parts": [{"text": user_prompt}]})
-            narration = response.text
+            # Send the user prompt and get response, filling the embed as it arrives when streaming
+            content = {"role": "user", "parts": [{"text": request_text}]}
+            if stream:
+                narration = ""
+                async for text in self.gemini_chat.client.stream_message(chat, content):
+                    narration += text
+                    await stream.update(narration)
+            else:
+                response = await self.gemini_chat.client.send_message(chat, content)
+                narration = response.text
             
             # Extract and save narrative elements for future context
-            narration = await self.extract_narrative_elements(narration, ic_channel_id)
+            parsed = await self.extract_narrative_elements(narration, ic_channel_id, self.structured_output)
             
-            # Update history - add only the actual user prompt and model response
-            self.game_histories[ic_channel_id].append({"role": "user", "content": user_prompt})
-            self.game_histories[ic_channel_id].append({"role": "model", "content": narration})
+            # Update history - add only the player's action and Emo's reply
+            self.record_turn(ic_channel_id, user_prompt, parsed.text)
             
-            return narration
+            return parsed
         except Exception as e:
             print(f"Error getting Gemini response: {e}")
-            return "Sorry, something went wrong with the narration!"
+            return ParsedNarration("Sorry, something went wrong with the narration!", [])
 
     @commands.command(name="emo")
     async def emo_narrate(self, ctx):
@@ -177,31 +677,66 @@ class EmoNarration(commands.Cog):
             return
 
         # Find the game associated with this channel as IC chat
-        game = None
-        for stored_game in (dnd_game.active_games.values() if not dnd_game.use_mongo else dnd_game.games_collection.find()):
-            if stored_game.get("ic_channel_id") == str(ctx.channel.id):
-                game = stored_game
-                break
+        game = await dnd_game.get_game_by_ic_channel(ctx.channel.id)
 
         if not game or not game.get("is_ai_gm"):
             await ctx.send("This command only works in the IC chat with Emo as GM!")
             return
 
-        # Get player info, theme, and detailed character data
-        character_names = [game["characters"][pid].get("name", "Unknown") for pid in game["player_ids"]]
-        players = ", ".join(character_names)
+        # A second !emo while the opening is being generated waits for it instead of starting another
+        adventure_message, shared = await self.openings.run(
+            str(ctx.channel.id),
+            lambda: self.narrate_opening(ctx, game)
+        )
+        if shared and adventure_message:
+            await ctx.send(f"Emo is already telling this story! Jump in here: {adventure_message.jump_url}")
+
+    def turn_lock(self, ic_channel_id):
+        """Lock that serializes everything narrated in an IC channel, openings and reply turns alike"""
+        return self.turn_locks.setdefault(ic_channel_id, asyncio.Lock())
+
+    async def narrate_opening(self, ctx, game):
+        """Narrate the opening under the channel's turn lock, returning the posted message"""
+        async with self.turn_lock(str(ctx.channel.id)):
+            return await self.post_opening(ctx, game)
+
+    async def post_opening(self, ctx, game):
+        """Generate and post the opening narration, returning the posted message"""
+        # The party roster reaches Gemini through the per-game context prefix
         theme = game["theme"]
-        character_details = []
-        for pid in game["player_ids"]:
-            char = game["characters"][pid]
-            name = char.get("name", "Unknown")
-            race = char.get("race", "Unknown")
-            char_class = char.get("class", "Unknown")
-            spells = ", ".join(char.get("spells", [])) or "None"
-            skills = ", ".join(char.get("skills", [])) or "None"
-            traits = ", ".join(char.get("traits", [])) or "None"
-            equipment = ", ".join(char.get("equipment", [])) or "None"
-            character_details.append(f"{name} (Race: {race}, Class: {char_class}, Spells: {spells}, Skills: {skills}, Traits: {traits}, Equipment: {equipment})")
+        ic_channel_id = str(ctx.channel.id)
+
+        # An opening prepared during campaign setup is used once, if the party hasn't changed since
+        opening = game.get("opening_narration")
+        if opening and opening.get("roster_signature") == self.roster_signature(game):
+            self.pregenerated_openings_used += 1
+            await self.bot.get_cog('DnDGame').set_opening_narration(game["channel_id"], None)
+            parsed = await self.extract_narrative_elements(opening["text"], ic_channel_id)
+            self.record_turn(ic_channel_id, OPENING_PROMPT, parsed.text)
+            narration = "\n".join([parsed.text] + await self.apply_narration_events(ic_channel_id, game, parsed.events))
+            adventure_embed = discord.Embed(
+                title=f"🎭 {theme} Adventure Begins!",
+                description=narration,
+                color=0x1E90FF  # Dodger Blue
+            )
+            adventure_embed.set_footer(text="Reply to this message to interact with the world")
+            adventure_message = await ctx.send(embed=adventure_embed)
+            self.remember_narration(adventure_message)
+            return adventure_message
+        if opening:
+            self.stale_openings += 1
+
+        # First-time adventure start with beginner-friendly approach
+        user_prompt = OPENING_JSON_PROMPT if self.structured_output else OPENING_PROMPT
+        
+        stream = await self.open_narration_stream(ctx.send, f"🎭 {theme} Adventure Begins!")
+        if stream:
+            # The streamed embed fills in right away, so there's no thinking message to post and delete
+            parsed = await self.get_gemini_response(user_prompt, ic_channel_id, game, stream)
+            narration = "\n".join([parsed.text] + await self.apply_narration_events(ic_channel_id, game, parsed.events))
+            await stream.finish(narration)
+            self.remember_narration(stream.message)
+            return stream.message
 
         # Set up embed for "Emo is thinking..." message
         thinking_embed = discord.Embed(
@@ -213,31 +748,9 @@ class EmoNarration(commands.Cog):
         
         thinking_message = await ctx.send(embed=thinking_embed)
 
-        # Improved storytelling system prompt
-        system_prompt = """You are Emo, a skilled and engaging Dungeon Master for a D&D adventure. Follow these storytelling guidelines:
-
-1. Begin with a brief, vivid scene description (2-3 lines) that helps players visualize where they are
-2. Use simple, everyday language that beginners can easily understand
-3. Introduce characters naturally, mentioning one interesting visual detail about each
-4. Present clear choices or opportunities for players without overwhelming them
-5. Only ask for dice rolls when truly necessary (major challenges, combat, or risky actions)
-6. When describing actions, focus on what players see, hear, and feel
-7. Create a sense of wonder and adventure appropriate for the theme
-8. Include occasional NPC interactions with distinct personalities
-9. Gently remind players of their character abilities when relevant
-10. Keep your narration under 7 lines for good pacing
-
-Special tags (these won't appear in the final text):
-- Use SCENE: tag to mark important location descriptions
-- Use NPC: Name: Description to track important non-player characters
-- If a dice roll is needed, include PENDING_ROLL: [character] must roll [dice] + [modifier] and explain why in everyday terms
-"""
-
-        # First-time adventure start with beginner-friendly approach
-        user_prompt = f"Start a {theme} adventure for players {players} with characters: {'; '.join(character_details)}. Create a beginner-friendly opening scene that introduces a simple goal or quest. Tag the scene description with SCENE: and any NPCs with NPC: tags. Use everyday language a new player would understand."
-        
         async with ctx.typing():
-            narration = await self.get_gemini_response(system_prompt, user_prompt, str(ctx.channel.id))
+            parsed = await self.get_gemini_response(user_prompt, ic_channel_id, game)
+            narration = "\n".join([parsed.text] + await self.apply_narration_events(ic_channel_id, game, parsed.events))
             
             # Create an engaging message with the narration
             adventure_embed = discord.Embed(
@@ -249,7 +762,9 @@ Special tags (these won't appear in the final text):
             
             # Delete the thinking message and send the adventure
             await thinking_message.delete()
-            await ctx.send(embed=adventure_embed)
+            adventure_message = await ctx.send(embed=adventure_embed)
+            self.remember_narration(adventure_message)
+            return adventure_message
 
     @commands.command(name="help_emo")
     async def help_emo(self, ctx):
@@ -301,12 +816,8 @@ Special tags (these won't appear in the final text):
                 print(f"Error sending message in roll_dice (no DnDGame): {e}")
             return
 
-        game = None
         channel_id = str(ctx.channel.id)
-        for stored_game in (dnd_game.active_games.values() if not dnd_game.use_mongo else dnd_game.games_collection.find()):
-            if stored_game.get("ooc_thread_id") == channel_id:
-                game = stored_game
-                break
+        game = await dnd_game.get_game_by_ooc_thread(channel_id)
 
         print(f"roll_dice: Game found: {game is not None}, State: {game.get('state') if game else 'None'}, Is thread: {isinstance(ctx.channel, discord.Thread)}")
         if not game or game.get("state") != "started" or not isinstance(ctx.channel, discord.Thread):
@@ -659,19 +1170,20 @@ Special tags (these won't appear in the final text):
         if not dnd_game:
             return
 
-        game = None
         ic_channel_id = str(message.channel.id)
-        for stored_game in (dnd_game.active_games.values() if not dnd_game.use_mongo else dnd_game.games_collection.find()):
-            if stored_game.get("ic_channel_id") == ic_channel_id:
-                game = stored_game
-                break
+        # Replies outside active IC channels are rejected without touching the game store,
+        # unless the set couldn't be loaded yet and may be missing started games
+        if dnd_game.ic_channels_loaded and ic_channel_id not in dnd_game.active_ic_channels:
+            self.fast_path_rejections += 1
+            return
+
+        game = await dnd_game.get_game_by_ic_channel(ic_channel_id)
 
         if not game or not game.get("is_ai_gm"):
             return
 
         # Check if replying to Emo's message
-        replied_msg = await message.channel.fetch_message(message.reference.message_id)
-        if replied_msg.author != self.bot.user:
+        if not await self.is_reply_to_emo(message):
             return
 
         # Identify the acting character
@@ -685,99 +1197,106 @@ Special tags (these won't appear in the final text):
             await message.reply("I don’t recognize you in this game!")
             return
 
-        character_names = [game["characters"][pid].get("name", "Unknown") for pid in game["player_ids"]]
-        players = ", ".join(character_names)
-        character_details = []
-        for pid in game["player_ids"]:
-            char = game["characters"][pid]
-            name = char.get("name", "Unknown")
-            race = char.get("race", "Unknown")
-            char_class = char.get("class", "Unknown")
-            spells = ", ".join(char.get("spells", [])) or "None"
-            skills = ", ".join(char.get("skills", [])) or "None"
-            traits = ", ".join(char.get("traits", [])) or "None"
-            equipment = ", ".join(char.get("equipment", [])) or "None"
-            character_details.append(f"{name} (Race: {race}, Class: {char_class}, Spells: {spells}, Skills: {skills}, Traits: {traits}, Equipment: {equipment})")
-    
-        system_prompt = """You are Emo, a skilled and engaging Dungeon Master for a D&D adventure. Follow these storytelling guidelines:
-1. Begin with a brief, vivid scene description (2-3 lines) that helps players visualize where they are
-2. Use simple, everyday language that beginners can easily understand
-3. Introduce characters naturally, mentioning one interesting visual detail about each
-4. Present clear choices or opportunities for players without overwhelming them
-5. Only ask for dice rolls when truly necessary (major challenges, combat, or risky actions)
-6. When describing actions, focus on what players see, hear, and feel
-7. Create a sense of wonder and adventure appropriate for the theme
-8. Include occasional NPC interactions with distinct personalities
-9. Gently remind players of their character abilities when relevant
-10. Keep your narration under 7 lines for good pacing
+        # Replies that arrive close together are answered by one narration
+        self.queue_action(ic_channel_id, message, acting_char, player_id)
 
-Special tags (these won't appear in the final text):
-- Use SCENE: tag to mark important location descriptions
-- Use NPC: Name: Description to track important non-player characters
-- If a dice roll is needed, include PENDING_ROLL: [character] must roll [dice] + [modifier] and explain why in everyday terms
-"""
-    
-        # Check pending actions for this character with better error handling
-        pending = self.pending_actions.get(ic_channel_id, {})
-        pending_for_char = pending.get(acting_char) if acting_char in pending else None
+    def queue_action(self, ic_channel_id, message, acting_char, player_id):
+        """Add a player's reply to the channel's next turn, starting the collection window if needed"""
+        # A double-sent reply is answered by the narration of the first copy
+        action_key = (player_id, " ".join(message.content.lower().split()))
+        in_flight = self.in_flight_actions.setdefault(ic_channel_id, set())
+        if action_key in in_flight:
+            self.duplicate_actions += 1
+            return
+        in_flight.add(action_key)
+        self.action_batches.setdefault(ic_channel_id, []).append(
+            {"message": message, "character": acting_char, "player_id": player_id, "key": action_key}
+        )
+        if ic_channel_id not in self.turn_tasks:
+            self.turn_tasks[ic_channel_id] = asyncio.create_task(self.run_turn(ic_channel_id))
+
+    async def run_turn(self, ic_channel_id):
+        """Wait out the batching window, then narrate every action collected for the channel
+        
+        Turns in a channel run one at a time; actions that arrive while a turn is being
+        narrated are collected into the next one.
+        """
+        try:
+            await asyncio.sleep(self.batch_window)
+            async with self.turn_lock(ic_channel_id):
+                actions = self.action_batches.pop(ic_channel_id, [])
+                self.turn_tasks.pop(ic_channel_id, None)
+                if actions:
+                    self.batched_actions += len(actions)
+                    self.turns += 1
+                    try:
+                        await self.narrate_turn(ic_channel_id, actions)
+                    finally:
+                        in_flight = self.in_flight_actions.get(ic_channel_id, set())
+                        for action in actions:
+                            in_flight.discard(action["key"])
+        finally:
+            if self.turn_tasks.get(ic_channel_id) is asyncio.current_task():
+                del self.turn_tasks[ic_channel_id]
+
+    async def narrate_turn(self, ic_channel_id, actions):
+        """Narrate one turn for a batch of player actions and apply its side effects"""
+        dnd_game = self.bot.get_cog('DnDGame')
+        game = await dnd_game.get_game_by_ic_channel(ic_channel_id) if dnd_game else None
+        if not game:
+            return
+        message = actions[-1]["message"]  # The narration answers the latest reply
+        actors = {action["character"]: action["player_id"] for action in actions}
         narration = ""
+        stream = None
     
         try:
-            if pending_for_char and message.content.strip().isdigit():
-                # Handle roll result
-                roll_result = int(message.content.strip())
-                user_prompt = f"Continue the {game['theme']} adventure for players {players} with characters: {'; '.join(character_details)}. {acting_char} rolled {roll_result} for {pending_for_char}."
-                async with message.channel.typing():
-                    narration = await self.get_gemini_response(system_prompt, user_prompt, ic_channel_id)
-                if acting_char in self.pending_actions.get(ic_channel_id, {}):
-                    del self.pending_actions[ic_channel_id][acting_char]
+            # When streaming, the reply embed is posted up front and filled in as the narration arrives
+            stream = await self.open_narration_stream(message.reply, f"🎭 {game['theme']} Adventure Continues")
+
+            # Check pending actions for each character; a bare number answers a pending roll
+            pending = self.pending_actions.get(ic_channel_id, {})
+            action_lines = []
+            rolled = []
+            for action in actions:
+                acting_char = action["character"]
+                content = action["message"].content.strip()
+                if acting_char in pending and content.isdigit():
+                    action_lines.append(f"{acting_char} rolled {int(content)} for {pending[acting_char]}.")
+                    rolled.append(acting_char)
+                else:
+                    action_lines.append(f"{acting_char}: {action['message'].content}")
+            if len(action_lines) == 1:
+                user_prompt = action_lines[0]
+            else:
+                user_prompt = "The party acts at the same time:\n" + "\n".join(f"- {line}" for line in action_lines)
+            
+            async with message.channel.typing():
+                parsed = await self.get_gemini_response(user_prompt, ic_channel_id, game, stream)
+            
+            if rolled:
+                for acting_char in rolled:
+                    self.pending_actions.get(ic_channel_id, {}).pop(acting_char, None)
                 if ic_channel_id in self.pending_actions and not self.pending_actions[ic_channel_id]:
                     del self.pending_actions[ic_channel_id]
                 await self.save_pending_action(ic_channel_id, {})
-            else:
-                # Process new action
-                user_prompt = f"Continue the {game['theme']} adventure for players {players} with characters: {'; '.join(character_details)}. Player action by {acting_char}: {message.content}"
-                async with message.channel.typing():
-                    narration = await self.get_gemini_response(system_prompt, user_prompt, ic_channel_id)
     
-            # Parse narration for HP and EXP changes
-            if dnd_game:
-                hp_match = re.search(r"(\w+) takes (\d+) damage", narration, re.IGNORECASE)
-                if hp_match:
-                    char_name, damage = hp_match.groups()
-                    if char_name == acting_char:
-                        await dnd_game.update_character_stats(ic_channel_id, player_id, -int(damage))
-                        narration += f"\n{acting_char}'s HP decreased by {damage}!"
-
-                heal_match = re.search(r"(\w+) heals for (\d+)", narration, re.IGNORECASE)
-                if heal_match:
-                    char_name, healing = heal_match.groups()
-                    if char_name == acting_char:
-                        await dnd_game.update_character_stats(ic_channel_id, player_id, int(healing))
-                        narration += f"\n{acting_char}'s HP increased by {healing}!"
-
-                exp_match = re.search(r"(\w+) gains (\d+) EXP", narration, re.IGNORECASE)
-                if exp_match:
-                    char_name, exp = exp_match.groups()
-                    if char_name == acting_char:
-                        await dnd_game.award_exp(ic_channel_id, player_id, int(exp))
-                        narration += f"\n{acting_char} gained {exp} EXP!"
-
-            # Check for new pending rolls in narration
-            if "PENDING_ROLL:" in narration:
-                match = re.search(r"PENDING_ROLL: (\w+) must roll (.+)", narration)
-                if match:
-                    char_name, roll = match.groups()
-                    await self.save_pending_action(ic_channel_id, {char_name: f"roll {roll}"})
-                    narration = narration.replace(match.group(0), f"{char_name}, please roll {roll} in your next reply.")
+            # HP and EXP changes for any named character, and new pending rolls
+            narration = "\n".join([parsed.text] + await self.apply_narration_events(ic_channel_id, game, parsed.events))
 
             # Add reminders for other pending actions
             if ic_channel_id in self.pending_actions:
                 reminders = [f"{char}, your roll for {action} is still pending!"
-                            for char, action in self.pending_actions[ic_channel_id].items() if char != acting_char]
+                            for char, action in self.pending_actions[ic_channel_id].items() if char not in actors]
                 if reminders:
                     narration += "\n" + "\n".join(reminders)
 
+            # Tag side effects are applied, so the streamed embed can show the final narration
+            if stream:
+                await stream.finish(narration)
+                self.remember_narration(stream.message)
+                return
+
             # Send narration as an embed
             adventure_embed = discord.Embed(
                 title=f"🎭 {game['theme']} Adventure Continues",
@@ -785,12 +1304,41 @@ Special tags (these won't appear in the final text):
                 color=0x1E90FF  # Dodger Blue
             )
             adventure_embed.set_footer(text="Reply to this message to interact with the world")
-            await message.reply(embed=adventure_embed)
+            adventure_message = await message.reply(embed=adventure_embed)
+            self.remember_narration(adventure_message)
 
         except Exception as e:
             error_msg = f"An error occurred while processing your action: {str(e)}"
-            await message.reply(error_msg)
-            print(f"Error in on_message for character {acting_char}: {str(e)}")
+            if stream:
+                await stream.finish(error_msg)
+            else:
+                await message.reply(error_msg)
+            print(f"Error narrating turn for {', '.join(actors)}: {str(e)}")
+
+    def get_stats(self):
+        """Counters shown by the !stats command"""
+        return {
+            "listener": {
+                "fast_path_rejections": self.fast_path_rejections,
+                "reply_fetches": self.reply_fetches
+            },
+            "turns": {
+                "turns": self.turns,
+                "actions": self.batched_actions,
+                "pending_batches": len(self.action_batches)
+            },
+            "openings": {
+                "pregenerated": self.openings_pregenerated,
+                "used": self.pregenerated_openings_used,
+                "stale": self.stale_openings
+            },
+            "single_flight": {
+                "suppressed_openings": self.openings.suppressed,
+                "suppressed_actions": self.duplicate_actions
+            },
+            "prompt_context": self.prompt_contexts.stats(),
+            "narration_store": self.narration_store.stats()
+        }
 
 async def setup(bot):
     await bot.add_cog(EmoNarration(bot))
\ No newline at end of file
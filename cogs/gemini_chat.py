@@ -2,57 +2,140 @@ import discord
 from discord.ext import commands
 import google.generativeai as genai
 import asyncio
+import json
 import re
 import os
-from dotenv import load_dotenv
-from pymongo import MongoClient
+import time
+from collections import OrderedDict
+from gemini_client import GeminiClient, estimate_tokens
+from context_cache import ContextCache, GeminiContextCacheBackend, LocalContextCacheBackend
 from datetime import datetime, timedelta, timezone
 from discord.ext import commands, tasks  
 
+class ChatSessionCache:
+    """Bounded LRU cache of live ChatSession objects with idle expiry"""
+    def __init__(self, max_size=500, idle_ttl=1800):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        # conversation_key -> {"chat", "conversation_id", "last_used"}, least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, conversation_key):
+        """Return the cached entry for a conversation, or None on a miss"""
+        entry = self.entries.get(conversation_key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        now = time.monotonic()
+        if now - entry["last_used"] > self.idle_ttl:
+            del self.entries[conversation_key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+        
+        entry["last_used"] = now
+        self.entries.move_to_end(conversation_key)
+        self.hits += 1
+        return entry
+    
+    def put(self, conversation_key, chat, conversation_id=None):
+        """Cache a live chat session, evicting the least recently used ones if full"""
+        self.entries[conversation_key] = {
+            "chat": chat,
+            "conversation_id": conversation_id,
+            "last_used": time.monotonic()
+        }
+        self.entries.move_to_end(conversation_key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+    
+    def discard(self, conversation_key):
+        """Drop a conversation from the cache, returning True if it was cached"""
+        return self.entries.pop(conversation_key, None) is not None
+    
+    def discard_matching(self, predicate):
+        """Drop every conversation whose key matches the predicate and return how many were dropped"""
+        keys = [key for key in self.entries if predicate(key)]
+        for key in keys:
+            del self.entries[key]
+        return len(keys)
+    
+    def prune_expired(self):
+        """Evict every entry that has been idle longer than the TTL"""
+        cutoff = time.monotonic() - self.idle_ttl
+        # Entries are ordered by last use, so stop at the first fresh one
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry["last_used"] > cutoff:
+                break
+            del self.entries[key]
+            self.evictions += 1
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
 class GeminiChat(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         
-        # Load environment variables
-        load_dotenv()
+        # Live chat sessions, shared by the MongoDB and in-memory modes
+        self.chat_cache = ChatSessionCache(
+            max_size=int(os.getenv('CHAT_CACHE_MAX_SIZE', 500)),
+            idle_ttl=int(os.getenv('CHAT_CACHE_IDLE_TTL', 1800))
+        )
+        self.prune_chat_cache.start()
+        
+        # Long conversations are checkpointed into a summary plus their last few turns
+        self.summary_token_threshold = int(os.getenv('ASK_SUMMARY_TOKENS', 6000))
+        self.summary_keep_turns = int(os.getenv('ASK_SUMMARY_KEEP_TURNS', 6))
+        self.checkpoint_tasks = {}  # conversation_id -> background checkpoint in progress
+        
+        # Environment variables are loaded by Emo.py
         api_key = os.getenv('GEMINI_API_KEY')
-        mongo_uri = os.getenv('MONGO_URI')
+        
+        # Borrow the bot-wide MongoDB connection pool created in Emo.py
+        self.db = getattr(bot, 'db', None)
+        self.use_mongo = self.db is not None
+        
+        # Async Gemini access shared with the DnD and narration cogs
+        self.client = GeminiClient(
+            max_concurrency=int(os.getenv('GEMINI_MAX_CONCURRENCY', 8)),
+            timeout=float(os.getenv('GEMINI_TIMEOUT', 60))
+        )
+        
+        # Optional caching of stable prompt prefixes, set up once a model is chosen
+        self.context_cache = None
         
         if not api_key:
             print("WARNING: GEMINI_API_KEY not found in .env file!")
             return
             
-        if not mongo_uri:
-            print("WARNING: MONGO_URI not found in .env file!")
-            print("Falling back to in-memory storage. Conversations will be lost on restart.")
-            self.use_mongo = False
-            self.conversations = {}
+        if not self.use_mongo:
+            print("GeminiChat is using in-memory storage. Conversations will be lost on restart.")
         else:
-            # Initialize MongoDB connection
-            try:
-                self.mongo_client = MongoClient(mongo_uri)
-                self.db = self.mongo_client['emo_bot']
-                self.conversations_collection = self.db['conversations']
-                self.messages_collection = self.db['conversation_messages']
-                self.use_mongo = True
-                print("Successfully connected to MongoDB")
-                
-                # Create indexes for faster queries
-                self.conversations_collection.create_index("conversation_key")
-                self.messages_collection.create_index("conversation_id")
-                self.messages_collection.create_index("timestamp")
-                
-                # Setup periodic cleanup of old conversations (runs once per day)
-                self.cleanup_old_conversations.start()
-            except Exception as e:
-                print(f"Failed to connect to MongoDB: {e}")
-                print("Falling back to in-memory storage. Conversations will be lost on restart.")
-                self.use_mongo = False
-                self.conversations = {}
+            # Setup periodic cleanup of old conversations (runs once per day)
+            self.cleanup_old_conversations.start()
             
         # Initialize Gemini API with your key
         genai.configure(api_key=api_key)
         
+        # Stream !ask answers into Discord as they are generated
+        self.stream_responses = os.getenv('GEMINI_STREAM_ASK', 'true').lower() != 'false'
+        self.stream_edit_interval = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))
+        
         # System prompt to customize AI behavior
         self.system_prompt = """
         Your name is Emo. You are a helpful, creative, and friendly Discord bot.
@@ -72,6 +155,7 @@ class GeminiChat(commands.Cog):
             print(f"Error listing models: {e}")
         
         # Create a Gemini model instance - using the newest model available
+        self.models = {}  # GenerativeModel per system instruction
         try:
             generation_config = {
                 "temperature": 0.7,
@@ -82,27 +166,56 @@ class GeminiChat(commands.Cog):
             
             # Try to use the best available model with fallbacks
             if "models/gemini-2.0-flash" in self.available_models:
-                self.model = genai.GenerativeModel(
-                    'gemini-2.0-flash',
-                    generation_config=generation_config
-                )
+                self.model_name = 'gemini-2.0-flash'
             elif "models/gemini-1.5-flash" in self.available_models:
-                self.model = genai.GenerativeModel(
-                    'gemini-1.5-flash',
-                    generation_config=generation_config
-                )
+                self.model_name = 'gemini-1.5-flash'
             elif "models/gemini-1.5-pro" in self.available_models:
-                self.model = genai.GenerativeModel(
-                    'gemini-1.5-pro',
-                    generation_config=generation_config
-                )
+                self.model_name = 'gemini-1.5-pro'
             else:
-                self.model = genai.GenerativeModel(
-                    'gemini-pro',
-                    generation_config=generation_config
-                )
+                self.model_name = 'gemini-pro'
+            self.generation_config = generation_config
+            
+            # Emo's persona is a model-level system instruction, so no conversation spends a request on it
+            self.model = self.get_model(self.system_prompt)
         except Exception as e:
             print(f"Error creating model: {e}")
+        
+        # Optional caching of stable prompt prefixes: "gemini" uses the caching API, "local" is an in-process stand-in
+        cache_mode = os.getenv('GEMINI_CONTEXT_CACHE', 'off').lower()
+        if cache_mode in ('gemini', 'local') and hasattr(self, 'model_name'):
+            if cache_mode == 'gemini':
+                backend = GeminiContextCacheBackend(os.getenv('GEMINI_CACHE_MODEL', f"models/{self.model_name}"))
+            else:
+                backend = LocalContextCacheBackend(self.model_name)
+            self.context_cache = ContextCache(
+                backend,
+                self.generation_config,
+                ttl=int(os.getenv('GEMINI_CONTEXT_CACHE_TTL', 900)),
+                # The caching API rejects small prefixes; the local stand-in takes any size
+                min_tokens=int(os.getenv('GEMINI_CACHE_MIN_TOKENS', 4096 if cache_mode == 'gemini' else 0))
+            )
+            print(f"Gemini context caching enabled ({cache_mode})")
+
+    def get_model(self, system_instruction=None, response_schema=None):
+        """Return the shared GenerativeModel configured with a system instruction
+        
+        Models are cached per instruction (and response schema, for JSON output) so the
+        chat, DnD and narration prompts are each built once and reused for every request.
+        """
+        key = (system_instruction, json.dumps(response_schema, sort_keys=True) if response_schema else None)
+        if key not in self.models:
+            self.models[key] = genai.GenerativeModel(
+                self.model_name,
+                generation_config=self.generation_config_for(response_schema),
+                system_instruction=system_instruction
+            )
+        return self.models[key]
+
+    def generation_config_for(self, response_schema=None):
+        """The shared generation config, asking for JSON matching response_schema if one is given"""
+        if not response_schema:
+            return self.generation_config
+        return dict(self.generation_config, response_mime_type="application/json", response_schema=response_schema)
 
     @tasks.loop(hours=24)
     async def cleanup_old_conversations(self):
@@ -113,136 +226,159 @@ class GeminiChat(commands.Cog):
         try:
             # Find conversations with no activity in the last 30 days
             thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-            old_conversations = self.conversations_collection.find(
-                {"last_updated": {"$lt": thirty_days_ago}}
-            )
             
             # Delete the conversations and their messages
-            for conv in old_conversations:
-                self.messages_collection.delete_many({"conversation_id": conv["_id"]})
-                self.conversations_collection.delete_one({"_id": conv["_id"]})
+            removed = await self.db.delete_conversations_before(thirty_days_ago)
                 
-            print(f"Cleaned up old conversations")
+            print(f"Cleaned up {removed} old conversations")
         except Exception as e:
             print(f"Error during conversation cleanup: {e}")
 
+    @tasks.loop(minutes=5)
+    async def prune_chat_cache(self):
+        """Evict chat sessions that have been idle past the cache TTL"""
+        self.chat_cache.prune_expired()
+
     async def get_conversation(self, conversation_key):
         """Get or create a conversation"""
+        # Hot conversations skip hydration entirely
+        cached = self.chat_cache.get(conversation_key)
+        if cached:
+            return cached["chat"]
+        
         if not self.use_mongo:
             # In-memory fallback
-            if conversation_key not in self.conversations:
-                chat = self.model.start_chat(history=[])
-                # Apply the system prompt for new conversations
-                await asyncio.to_thread(chat.send_message, self.system_prompt)
-                self.conversations[conversation_key] = chat
-            return self.conversations[conversation_key]
+            chat = self.model.start_chat(history=[])
+            self.chat_cache.put(conversation_key, chat)
+            return chat
         else:
             # MongoDB implementation
-            conversation = self.conversations_collection.find_one({"conversation_key": conversation_key})
+            conversation = await self.db.find_conversation(conversation_key)
             
             if not conversation:
                 # Create a new conversation in the database
-                conversation_id = self.conversations_collection.insert_one({
-                    "conversation_key": conversation_key,
-                    "created_at": datetime.now(timezone.utc),
-                    "last_updated": datetime.now(timezone.utc)
-                }).inserted_id
+                conversation_id = await self.db.create_conversation(conversation_key)
                 
-                # Start a new chat with Gemini
+                # Start a new chat with Gemini; the model already carries the system prompt
                 chat = self.model.start_chat(history=[])
-                # Apply system prompt and store it
-                response = await asyncio.to_thread(chat.send_message, self.system_prompt)
-                
-                # Store system prompt in messages collection
-                self.messages_collection.insert_one({
-                    "conversation_id": conversation_id,
-                    "role": "user",
-                    "content": self.system_prompt,
-                    "is_system_prompt": True,
-                    "timestamp": datetime.now(timezone.utc)
-                })
-                
-                self.messages_collection.insert_one({
-                    "conversation_id": conversation_id,
-                    "role": "model",
-                    "content": response.text,
-                    "is_system_prompt": True,
-                    "timestamp": datetime.now(timezone.utc)
-                })
                 
+                self.chat_cache.put(conversation_key, chat, conversation_id)
                 return chat
             else:
-                # Restore conversation from database
-                chat = self.model.start_chat(history=[])
-                messages = self.messages_collection.find(
-                    {"conversation_id": conversation["_id"]}
-                ).sort("timestamp", 1)  # Sort by timestamp ascending
-                
-                # Restore message history to the chat
-                for msg in messages:
-                    if msg.get("is_system_prompt", False):
-                        continue  # Skip the system prompt, it's already been applied
-                    
-                    # Simulate the message exchange to rebuild history
-                    if msg["role"] == "user":
-                        try:
-                            response = await asyncio.to_thread(chat.send_message, msg["content"])
-                            # Verify the response matches what we have stored
-                            stored_response = self.messages_collection.find_one({
-                                "conversation_id": conversation["_id"],
-                                "role": "model",
-                                "timestamp": {"$gt": msg["timestamp"]}
-                            }, sort=[("timestamp", 1)])
-                            
-                            if stored_response and response.text != stored_response["content"]:
-                                print("Warning: Restored response doesn't match stored response")
-                        except Exception as e:
-                            print(f"Error restoring conversation: {e}")
-                            # If we encounter an error, start a fresh chat
-                            return self.model.start_chat(history=[])
+                # Restore conversation from database in a single projected read
+                history = await self.load_history(conversation_key, conversation)
+                chat = self.model.start_chat(history=history)
                 
                 # Update last accessed timestamp
-                self.conversations_collection.update_one(
-                    {"_id": conversation["_id"]},
-                    {"$set": {"last_updated": datetime.now(timezone.utc)}}
-                )
+                await self.db.touch_conversation(conversation["_id"])
                 
+                self.chat_cache.put(conversation_key, chat, conversation["_id"])
                 return chat
 
+    async def load_history(self, conversation_key, conversation):
+        """Build Gemini chat history from the stored summary and every message not yet folded into it
+        
+        Checkpoints keep the unfolded messages bounded. Conversations stored before token
+        estimates existed get one here, and are checkpointed right away if already too long.
+        """
+        conversation_id = conversation["_id"]
+        summary = await self.db.get_conversation_summary(conversation_id)
+        messages = await self.db.load_messages(conversation_id)
+        
+        if "token_estimate" not in conversation:
+            token_estimate = sum(estimate_tokens(msg["content"]) for msg in messages)
+            await self.db.set_token_estimate(conversation_id, token_estimate)
+            if token_estimate > self.summary_token_threshold:
+                self.schedule_checkpoint(conversation_key, conversation_id)
+        
+        return self.summary_history(summary) + [{"role": msg["role"], "parts": [msg["content"]]} for msg in messages]
+
+    def summary_history(self, summary):
+        """History turns that hand a conversation summary to the model"""
+        if not summary:
+            return []
+        return [
+            {"role": "user", "parts": [f"Summary of our conversation so far:\n{summary}"]},
+            {"role": "model", "parts": ["Got it, I remember where we left off."]}
+        ]
+
+    async def checkpoint_conversation(self, conversation_key, conversation_id):
+        """Fold all but the most recent turns of a conversation into its stored summary"""
+        try:
+            messages = await self.db.load_messages(conversation_id, with_ids=True)
+            # Keep at most the last few turns and half the threshold's tokens, so the next
+            # checkpoint is a while off; the latest turn always stays. Fold whole user/model pairs only.
+            keep = min(self.summary_keep_turns * 2, len(messages))
+            keep -= keep % 2
+            kept = messages[len(messages) - keep:]
+            kept_tokens = sum(estimate_tokens(msg["content"]) for msg in kept)
+            while len(kept) > 2 and kept_tokens > self.summary_token_threshold / 2:
+                kept_tokens -= estimate_tokens(kept[0]["content"]) + estimate_tokens(kept[1]["content"])
+                kept = kept[2:]
+            folded = messages[:len(messages) - len(kept)]
+            folded = folded[:len(folded) - len(folded) % 2]
+            if not folded:
+                return
+            
+            previous_summary = await self.db.get_conversation_summary(conversation_id)
+            summary = await self.client.summarize(
+                self.get_model(),
+                folded,
+                previous_summary or "",
+                subject="conversation between a user and Emo"
+            )
+            folded_tokens = sum(estimate_tokens(msg["content"]) for msg in folded)
+            await self.db.save_conversation_checkpoint(conversation_id, summary, [msg["_id"] for msg in folded], folded_tokens)
+            
+            # Trim the live session the same way so its prompts shrink too. It holds the previous
+            # summary pair plus every unfolded message, including turns added while summarizing.
+            cached = self.chat_cache.entries.get(conversation_key)
+            if cached and cached["conversation_id"] == conversation_id:
+                chat = cached["chat"]
+                folded_end = len(self.summary_history(previous_summary)) + len(folded)
+                if len(chat.history) >= folded_end:
+                    chat.history = self.summary_history(summary) + list(chat.history[folded_end:])
+            print(f"Checkpointed {len(folded)} messages of conversation {conversation_id}")
+        except Exception as e:
+            print(f"Error checkpointing conversation: {e}")
+        finally:
+            self.checkpoint_tasks.pop(conversation_id, None)
+
+    def schedule_checkpoint(self, conversation_key, conversation_id):
+        """Start checkpointing a conversation unless it's already in progress"""
+        # Summarizing costs a Gemini call, so it runs in the background after the answer has been shown
+        if conversation_id not in self.checkpoint_tasks:
+            self.checkpoint_tasks[conversation_id] = asyncio.create_task(
+                self.checkpoint_conversation(conversation_key, conversation_id)
+            )
+
     async def store_message(self, conversation_key, user_message, ai_response):
         """Store message history in MongoDB"""
         if not self.use_mongo:
             return  # No need to store if not using MongoDB
             
         try:
-            # Find the conversation document
-            conversation = self.conversations_collection.find_one({"conversation_key": conversation_key})
-            if not conversation:
-                return
+            # Cached sessions already know their conversation document
+            cached = self.chat_cache.entries.get(conversation_key)
+            if cached and cached["conversation_id"] is not None:
+                conversation_id = cached["conversation_id"]
+            else:
+                conversation = await self.db.find_conversation(conversation_key)
+                if not conversation:
+                    return
+                conversation_id = conversation["_id"]
                 
-            # Store user message
-            self.messages_collection.insert_one({
-                "conversation_id": conversation["_id"],
-                "role": "user",
-                "content": user_message,
-                "is_system_prompt": False,
-                "timestamp": datetime.now(timezone.utc)
-            })
-            
-            # Store AI response
-            self.messages_collection.insert_one({
-                "conversation_id": conversation["_id"],
-                "role": "model",
-                "content": ai_response,
-                "is_system_prompt": False,
-                "timestamp": datetime.now(timezone.utc)
-            })
+            # Store the user message and AI response together
+            await self.db.insert_messages(conversation_id, [("user", user_message), ("model", ai_response)])
             
-            # Update last_updated timestamp
-            self.conversations_collection.update_one(
-                {"_id": conversation["_id"]},
-                {"$set": {"last_updated": datetime.now(timezone.utc)}}
+            # Update last_updated timestamp and the size of the unsummarized tail
+            token_estimate = await self.db.touch_conversation(
+                conversation_id,
+                estimate_tokens(user_message) + estimate_tokens(ai_response)
             )
+            
+            if token_estimate > self.summary_token_threshold:
+                self.schedule_checkpoint(conversation_key, conversation_id)
         except Exception as e:
             print(f"Error storing messages: {e}")
 
@@ -268,23 +404,27 @@ class GeminiChat(commands.Cog):
             
             # Send the question to Gemini
             try:
-                response = await asyncio.to_thread(
-                    chat.send_message,
-                    question
-                )
+                if self.stream_responses:
+                    response_text = await self._stream_answer(ctx, thinking_msg, chat, question)
+                else:
+                    response = await self.client.send_message(chat, question)
+                    # Remove any "As a language model" or similar phrases
+                    response_text = self._clean_ai_disclaimers(response.text)
+            except asyncio.TimeoutError:
+                self.chat_cache.discard(conversation_key)
+                await thinking_msg.edit(content="⚠️ Emo took too long to answer. Please try again!")
+                return
             except Exception as e:
+                self.chat_cache.discard(conversation_key)
                 await thinking_msg.edit(content=f"⚠️ Error sending message: {str(e)}")
                 return
             
-            # Get the response text
-            response_text = response.text
-            
-            # Remove any "As a language model" or similar phrases
-            response_text = self._clean_ai_disclaimers(response_text)
-            
-            # Store the message pair in MongoDB if available
+            # The cached session already holds the new turn; write it through to MongoDB
             await self.store_message(conversation_key, question, response_text)
             
+            if self.stream_responses:
+                return  # Already shown while streaming
+            
             # Split the response if it's too long for Discord (2000 char limit)
             if len(response_text) <= 1900:
                 await thinking_msg.edit(content=f"**You asked:** {question}\n\n**Emo says:** {response_text}")
@@ -304,11 +444,59 @@ class GeminiChat(commands.Cog):
         
         except Exception as e:
             await ctx.send(f"⚠️ Error: {str(e)}")
-            # Reset conversation on error
-            if not self.use_mongo:
-                conversation_key = f"{ctx.channel.id}_{ctx.author.id}"
-                if conversation_key in self.conversations:
-                    del self.conversations[conversation_key]
+            # Reset the cached session on error so the next question starts from a clean state
+            self.chat_cache.discard(f"{ctx.channel.id}_{ctx.author.id}")
+    
+    async def _stream_answer(self, ctx, thinking_msg, chat, question):
+        """Stream Gemini's answer into Discord, editing messages as chunks arrive
+        
+        Edits are coalesced to at most one round per stream_edit_interval so we stay
+        under Discord's per-channel edit rate limit; text past 1900 characters rolls
+        over into new messages at the same boundaries _split_text uses.
+        """
+        messages = [thinking_msg]
+        shown = [thinking_msg.content]
+        text = ""
+        last_render = time.monotonic()
+        
+        async for piece in self.client.stream_message(chat, question):
+            text += piece
+            if time.monotonic() - last_render >= self.stream_edit_interval:
+                await self._render_stream(ctx, messages, shown, question, self._clean_ai_disclaimers(text), final=False)
+                last_render = time.monotonic()
+        
+        response_text = self._clean_ai_disclaimers(text)
+        await self._render_stream(ctx, messages, shown, question, response_text, final=True)
+        return response_text
+    
+    async def _render_stream(self, ctx, messages, shown, question, text, final):
+        """Bring the streamed messages up to date with the text received so far"""
+        chunks = self._split_text(text) if text else ["…"]
+        for i, chunk in enumerate(chunks):
+            if final and len(chunks) > 1:
+                label = f"Emo says (part {i+1}/{len(chunks)})" if i == 0 else f"Emo continues (part {i+1}/{len(chunks)})"
+            else:
+                label = "Emo says" if i == 0 else "Emo continues"
+            content = f"**{label}:** {chunk}"
+            if i == 0:
+                content = f"**You asked:** {question}\n\n{content}"
+            if not final and i == len(chunks) - 1:
+                content += " ▌"
+            
+            if i < len(messages):
+                # Only edit messages whose text actually changed
+                if shown[i] != content:
+                    await messages[i].edit(content=content)
+                    shown[i] = content
+            else:
+                messages.append(await ctx.send(content))
+                shown.append(content)
+        
+        # A paragraph can move forward into the next message, so clear any messages left over
+        for i in range(len(chunks), len(messages)):
+            if shown[i] != "\u200b":
+                await messages[i].edit(content="\u200b")
+                shown[i] = "\u200b"
     
     @commands.command()
     async def list_models(self, ctx):
@@ -330,21 +518,19 @@ class GeminiChat(commands.Cog):
         Example: !reset_chat
         """
         conversation_key = f"{ctx.channel.id}_{ctx.author.id}"
+        was_cached = self.chat_cache.discard(conversation_key)
         
         if not self.use_mongo:
-            if conversation_key in self.conversations:
-                del self.conversations[conversation_key]
+            if was_cached:
                 await ctx.send("✅ Your chat history with Emo has been reset for this channel!")
             else:
                 await ctx.send("You don't have an active chat with Emo in this channel.")
         else:
             # MongoDB implementation
-            conversation = self.conversations_collection.find_one({"conversation_key": conversation_key})
+            conversation = await self.db.find_conversation(conversation_key)
             if conversation:
-                # Delete all messages for this conversation
-                self.messages_collection.delete_many({"conversation_id": conversation["_id"]})
-                # Delete the conversation itself
-                self.conversations_collection.delete_one({"_id": conversation["_id"]})
+                # Delete the conversation and all its messages
+                await self.db.delete_conversations([conversation["_id"]])
                 await ctx.send("✅ Your chat history with Emo has been reset for this channel!")
             else:
                 await ctx.send("You don't have an active chat with Emo in this channel.")
@@ -356,39 +542,19 @@ class GeminiChat(commands.Cog):
         Example: !reset_all_chats
         """
         user_id = ctx.author.id
+        # Drop all cached sessions for this user
+        cached_count = self.chat_cache.discard_matching(lambda key: key.endswith(f"_{user_id}"))
         
         if not self.use_mongo:
-            # Find all conversations for this user
-            user_conversations = [key for key in self.conversations.keys() if key.endswith(f"_{user_id}")]
-            
-            if user_conversations:
-                # Delete all conversations for this user
-                for key in user_conversations:
-                    del self.conversations[key]
-                await ctx.send(f"✅ All your chat histories with Emo have been reset across {len(user_conversations)} channels!")
+            if cached_count:
+                await ctx.send(f"✅ All your chat histories with Emo have been reset across {cached_count} channels!")
             else:
                 await ctx.send("You don't have any active chats with Emo.")
         else:
             # MongoDB implementation
-            pattern = f".*_{user_id}$"
-            cursor = self.conversations_collection.find({"conversation_key": {"$regex": pattern}})
+            conversation_count = await self.db.delete_user_conversations(user_id)
             
-            conversation_count = 0
-            conversation_ids = []
-            
-            # Collect all conversation IDs first
-            for conversation in cursor:
-                conversation_ids.append(conversation["_id"])
-                conversation_count += 1
-                
-            # Then delete all messages and conversations
-            if conversation_ids:
-                for conv_id in conversation_ids:
-                    # Delete all messages for this conversation
-                    self.messages_collection.delete_many({"conversation_id": conv_id})
-                    # Delete the conversation itself
-                    self.conversations_collection.delete_one({"_id": conv_id})
-                
+            if conversation_count:
                 await ctx.send(f"✅ All your chat histories with Emo have been reset across {conversation_count} channels!")
             else:
                 await ctx.send("You don't have any active chats with Emo.")
@@ -466,11 +632,21 @@ class GeminiChat(commands.Cog):
         
         return result
     
+    def get_stats(self):
+        """Counters shown by the !stats command"""
+        return {
+            "chat_cache": self.chat_cache.stats(),
+            "gemini": self.client.stats(),
+            "context_cache": self.context_cache.stats() if self.context_cache else {"enabled": False}
+        }
+    
     def cog_unload(self):
         """Clean up resources when the cog is unloaded"""
+        self.prune_chat_cache.cancel()
+        for task in list(self.checkpoint_tasks.values()):
+            task.cancel()
         if self.use_mongo:
             self.cleanup_old_conversations.cancel()
-            self.mongo_client.close()
 
 async def setup(bot):
     await bot.add_cog(GeminiChat(bot))
\ No newline at end of file
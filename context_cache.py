@@ -0,0 +1,172 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import time
+import google.generativeai as genai
+from gemini_client import estimate_tokens
+
+class GeminiContextCacheBackend:
+    """Stores prompt prefixes as server-side CachedContent so Gemini doesn't re-process them each turn"""
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    async def create(self, system_instruction, contents, ttl):
+        # The caching API is synchronous, so keep it off the event loop
+        return await asyncio.to_thread(
+            genai.caching.CachedContent.create,
+            model=self.model_name,
+            system_instruction=system_instruction,
+            contents=contents,
+            ttl=datetime.timedelta(seconds=ttl)
+        )
+
+    async def refresh(self, handle, ttl):
+        await asyncio.to_thread(handle.update, ttl=datetime.timedelta(seconds=ttl))
+
+    async def delete(self, handle):
+        await asyncio.to_thread(handle.delete)
+
+    def model_for(self, handle, generation_config):
+        return genai.GenerativeModel.from_cached_content(cached_content=handle, generation_config=generation_config)
+
+class LocalCachedModel:
+    """Stand-in for a model bound to cached content: the prefix is prepended to every chat"""
+    def __init__(self, model, contents):
+        self.model = model
+        self.contents = contents
+
+    def start_chat(self, history=None):
+        return self.model.start_chat(history=self.contents + list(history or []))
+
+class LocalContextCacheBackend:
+    """In-process backend with the same interface, for local runs and tests without the caching API
+
+    Nothing is cached server-side; the prefix is simply sent along as history again.
+    """
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    async def create(self, system_instruction, contents, ttl):
+        return {"system_instruction": system_instruction, "contents": list(contents)}
+
+    async def refresh(self, handle, ttl):
+        pass
+
+    async def delete(self, handle):
+        pass
+
+    def model_for(self, handle, generation_config):
+        model = genai.GenerativeModel(
+            self.model_name,
+            generation_config=generation_config,
+            system_instruction=handle["system_instruction"]
+        )
+        return LocalCachedModel(model, handle["contents"])
+
+class ContextCache:
+    """Registers stable prompt prefixes (system instruction plus leading turns) with a cache backend
+
+    Each key (e.g. one IC channel) owns at most one cached prefix. Creating, replacing and
+    refreshing caches all happen in the background, so a turn never waits on the backend:
+    until a prefix is ready, callers send it uncached. Prefixes below min_tokens are never
+    registered, since the caching API rejects them. Caches of idle keys simply expire.
+    """
+    def __init__(self, backend, generation_config, ttl=900, min_tokens=0):
+        self.backend = backend
+        self.generation_config = generation_config
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.entries = {}  # key -> {"signature", "handle", "model", "expires_at", "refreshing"}
+        self.tasks = set()  # Background creates, refreshes and deletes
+        self.hits = 0
+        self.misses = 0
+        self.creates = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.too_small = 0
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def get_model(self, key, system_instruction, contents, generation_config=None):
+        """Return a model that already holds the prefix, or None to send the prefix uncached this time"""
+        generation_config = generation_config or self.generation_config
+        payload = json.dumps([system_instruction, contents, generation_config], sort_keys=True, default=str)
+        signature = hashlib.sha256(payload.encode()).hexdigest()
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry and entry["signature"] == signature and entry["expires_at"] > now:
+            if entry["model"] is None:
+                # Still being created, too small, or creating it failed; don't retry until it changes
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Extend the TTL on activity, but at most once per half TTL
+            if entry["expires_at"] - now < self.ttl / 2 and not entry["refreshing"]:
+                entry["refreshing"] = True
+                self.spawn(self._refresh(entry))
+            return entry["model"]
+
+        self.misses += 1
+        if entry and entry["handle"] is not None:
+            self.spawn(self.discard_handle(entry["handle"]))
+        entry = {"signature": signature, "handle": None, "model": None, "expires_at": now + self.ttl, "refreshing": False}
+        self.entries[key] = entry
+        if estimate_tokens(payload) < self.min_tokens:
+            self.too_small += 1
+        else:
+            self.spawn(self._create(key, entry, system_instruction, contents, generation_config))
+        return None
+
+    async def _create(self, key, entry, system_instruction, contents, generation_config):
+        try:
+            handle = await self.backend.create(system_instruction, contents, self.ttl)
+            model = self.backend.model_for(handle, generation_config)
+            self.creates += 1
+        except Exception as e:
+            print(f"Error creating cached context: {e}")
+            self.failures += 1
+            return
+        if self.entries.get(key) is not entry:
+            # The prefix changed or was discarded while this cache was being created
+            await self.discard_handle(handle)
+            return
+        entry["handle"] = handle
+        entry["model"] = model
+        entry["expires_at"] = time.monotonic() + self.ttl
+
+    async def _refresh(self, entry):
+        try:
+            await self.backend.refresh(entry["handle"], self.ttl)
+            entry["expires_at"] = time.monotonic() + self.ttl
+            self.refreshes += 1
+        except Exception as e:
+            print(f"Error refreshing cached context: {e}")
+        finally:
+            entry["refreshing"] = False
+
+    async def discard_handle(self, handle):
+        try:
+            await self.backend.delete(handle)
+        except Exception as e:
+            print(f"Error deleting cached context: {e}")
+
+    async def discard(self, key):
+        """Forget a key, deleting its cached prefix (a creation still in flight deletes its own)"""
+        entry = self.entries.pop(key, None)
+        if entry and entry["handle"] is not None:
+            await self.discard_handle(entry["handle"])
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "creates": self.creates,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "too_small": self.too_small
+        }
@@ -0,0 +1,369 @@
+import threading
+from datetime import datetime, timezone
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Update-pipeline expression bumping a game's version, so compare-and-swap writers see atomic updates too
+VERSION_INCREMENT = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+
+def hp_expression(player_id, hp_change):
+    """Pipeline expression adding hp_change to a character's HP, clamped to [0, max_hp]"""
+    hp_path = f"characters.{player_id}.hp"
+    max_hp_path = f"characters.{player_id}.max_hp"
+    return {"$max": [0, {"$min": [
+        {"$add": [{"$ifNull": [f"${hp_path}", 20]}, hp_change]},
+        {"$ifNull": [f"${max_hp_path}", 20]}
+    ]}]}
+
+def exp_expression(player_id, exp_gain):
+    exp_path = f"characters.{player_id}.exp"
+    return {"$add": [{"$ifNull": [f"${exp_path}", 0]}, exp_gain]}
+
+def level_expression(player_id):
+    """The level only goes up: the first level whose threshold (level * 20) exceeds the EXP"""
+    exp_path = f"characters.{player_id}.exp"
+    level_path = f"characters.{player_id}.level"
+    return {"$max": [
+        {"$toInt": {"$ifNull": [f"${level_path}", 1]}},
+        {"$toInt": {"$add": [{"$floor": {"$divide": [f"${exp_path}", 20]}}, 1]}}
+    ]}
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so pool usage can be observed"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections_open = 0
+        self.connections_created = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self.lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self.lock:
+            self.connections_open += 1
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.connections_open -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "connections_open": self.connections_open,
+                "connections_created": self.connections_created,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears
+            }
+
+class Database:
+    """Non-blocking MongoDB access for conversations, messages and D&D games
+
+    One instance is created by Emo.py and shared by every cog through ``bot.db``.
+    """
+    def __init__(self, mongo_uri, db_name='emo_bot', max_pool_size=50, min_pool_size=0,
+                 server_selection_timeout_ms=5000, connect_timeout_ms=10000, wait_queue_timeout_ms=10000):
+        self.pool_listener = PoolStatsListener()
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.client = AsyncIOMotorClient(
+            mongo_uri,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            connectTimeoutMS=connect_timeout_ms,
+            waitQueueTimeoutMS=wait_queue_timeout_ms,
+            event_listeners=[self.pool_listener]
+        )
+        self.db = self.client[db_name]
+        self.conversations = self.db['conversations']
+        self.messages = self.db['conversation_messages']
+        self.summaries = self.db['conversation_summaries']
+        self.games = self.db['dnd_games']
+
+    async def ensure_indexes(self):
+        """Create the indexes the bot's queries rely on"""
+        await self.conversations.create_index("conversation_key")
+        await self.messages.create_index("conversation_id")
+        await self.messages.create_index("timestamp")
+        await self.messages.create_index([("conversation_id", 1), ("timestamp", 1)])
+        await self.summaries.create_index("conversation_id", unique=True)
+        await self.games.create_index("channel_id", unique=True)
+        await self.games.create_index("ic_channel_id", unique=True, sparse=True)
+        await self.games.create_index("ooc_thread_id", unique=True, sparse=True)
+
+    # --- Conversations ---
+
+    async def find_conversation(self, conversation_key):
+        return await self.conversations.find_one({"conversation_key": conversation_key})
+
+    async def create_conversation(self, conversation_key):
+        """Insert a new conversation document and return its id"""
+        now = datetime.now(timezone.utc)
+        result = await self.conversations.insert_one({
+            "conversation_key": conversation_key,
+            "created_at": now,
+            "last_updated": now
+        })
+        return result.inserted_id
+
+    async def touch_conversation(self, conversation_id, tokens=0):
+        """Mark a conversation as active, adding tokens to its estimate of unsummarized messages
+
+        Returns the updated token estimate.
+        """
+        conversation = await self.conversations.find_one_and_update(
+            {"_id": conversation_id},
+            {"$set": {"last_updated": datetime.now(timezone.utc)}, "$inc": {"token_estimate": tokens}},
+            projection={"_id": 0, "token_estimate": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return conversation["token_estimate"] if conversation else 0
+
+    async def set_token_estimate(self, conversation_id, tokens):
+        """Set the token estimate of a conversation stored before estimates were tracked"""
+        await self.conversations.update_one({"_id": conversation_id}, {"$set": {"token_estimate": tokens}})
+
+    async def load_messages(self, conversation_id, with_ids=False):
+        """Return the stored messages of a conversation, oldest first
+
+        System prompt pairs stored by older versions are skipped; the model carries the prompt now.
+        """
+        projection = {"_id": 1 if with_ids else 0, "role": 1, "content": 1}
+        query = {"conversation_id": conversation_id, "is_system_prompt": {"$ne": True}}
+        cursor = self.messages.find(query, projection).sort([("timestamp", 1), ("_id", 1)])  # Insertion order breaks timestamp ties
+        return await cursor.to_list(length=None)
+
+    async def get_conversation_summary(self, conversation_id):
+        """Return the summary of a conversation's checkpointed turns, or None"""
+        document = await self.summaries.find_one({"conversation_id": conversation_id}, {"_id": 0, "summary": 1})
+        return document["summary"] if document else None
+
+    async def save_conversation_checkpoint(self, conversation_id, summary, folded_message_ids, folded_tokens):
+        """Replace folded messages with an updated summary document"""
+        await self.summaries.update_one(
+            {"conversation_id": conversation_id},
+            {"$set": {"summary": summary, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        await self.messages.delete_many({"_id": {"$in": folded_message_ids}})
+        await self.conversations.update_one({"_id": conversation_id}, {"$inc": {"token_estimate": -folded_tokens}})
+
+    async def insert_messages(self, conversation_id, messages, is_system_prompt=False):
+        """Store (role, content) pairs for a conversation in one round trip"""
+        now = datetime.now(timezone.utc)
+        await self.messages.insert_many([
+            {
+                "conversation_id": conversation_id,
+                "role": role,
+                "content": content,
+                "is_system_prompt": is_system_prompt,
+                "timestamp": now
+            }
+            for role, content in messages
+        ], ordered=True)
+
+    async def delete_conversations(self, conversation_ids):
+        """Delete conversations with all their messages and summaries"""
+        if not conversation_ids:
+            return
+        await self.messages.delete_many({"conversation_id": {"$in": conversation_ids}})
+        await self.summaries.delete_many({"conversation_id": {"$in": conversation_ids}})
+        await self.conversations.delete_many({"_id": {"$in": conversation_ids}})
+
+    async def delete_user_conversations(self, user_id):
+        """Delete every conversation of a user across channels and return how many were removed"""
+        cursor = self.conversations.find(
+            {"conversation_key": {"$regex": f".*_{user_id}$"}},
+            {"_id": 1}
+        )
+        conversation_ids = [conv["_id"] for conv in await cursor.to_list(length=None)]
+        await self.delete_conversations(conversation_ids)
+        return len(conversation_ids)
+
+    async def delete_conversations_before(self, cutoff):
+        """Delete conversations with no activity since the cutoff"""
+        cursor = self.conversations.find({"last_updated": {"$lt": cutoff}}, {"_id": 1})
+        conversation_ids = [conv["_id"] for conv in await cursor.to_list(length=None)]
+        await self.delete_conversations(conversation_ids)
+        return len(conversation_ids)
+
+    # --- D&D games ---
+
+    async def get_game(self, channel_id):
+        return await self.games.find_one({"channel_id": str(channel_id)})
+
+    async def save_game(self, channel_id, game_data):
+        """Compare-and-swap save of a whole game document
+
+        The write only applies if the stored version still equals game_data's version
+        (documents without one count as version 0, and a missing game is inserted).
+        On success game_data's version is bumped and True is returned; False means
+        another writer saved first and the caller should re-read and retry.
+        """
+        expected_version = game_data.get("version", 0)
+        version_filter = expected_version if expected_version else {"$in": [0, None]}
+        document = {key: value for key, value in game_data.items() if key != "_id"}
+        document["version"] = expected_version + 1
+        # Never upsert on the version filter: a stale save would insert a second game
+        result = await self.games.replace_one({"channel_id": str(channel_id), "version": version_filter}, document)
+        if result.matched_count:
+            game_data["version"] = document["version"]
+            return True
+        if expected_version:
+            return False
+
+        # A new game is inserted only if no game exists for the channel yet
+        try:
+            result = await self.games.update_one(
+                {"channel_id": str(channel_id)},
+                {"$setOnInsert": document},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Another writer inserted the game first
+            return False
+        if result.upserted_id is None:
+            return False
+        game_data["version"] = document["version"]
+        game_data["_id"] = result.upserted_id
+        return True
+
+    async def set_game_fields(self, channel_id, fields):
+        """Atomically set top-level fields on a game and return just those fields and the new version"""
+        return await self.games.find_one_and_update(
+            {"channel_id": str(channel_id)},
+            {"$set": fields, "$inc": {"version": 1}},
+            projection={"_id": 0, "version": 1, **{key: 1 for key in fields}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def adjust_character_hp(self, channel_id, player_id, hp_change):
+        """Atomically add hp_change to a character's HP, clamped to [0, max_hp]
+
+        Returns the updated character and game version, or None if there is no such character.
+        """
+        return await self.games.find_one_and_update(
+            {"channel_id": str(channel_id), f"characters.{player_id}": {"$exists": True}},
+            [{"$set": {
+                f"characters.{player_id}.hp": hp_expression(player_id, hp_change),
+                "version": VERSION_INCREMENT
+            }}],
+            projection={"_id": 0, "version": 1, f"characters.{player_id}": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def add_character_exp(self, channel_id, player_id, exp_gain):
+        """Atomically add EXP to a character and raise its level to match (20 EXP per level)
+
+        Returns the updated character and game version, or None if there is no such character.
+        """
+        return await self.games.find_one_and_update(
+            {"channel_id": str(channel_id), f"characters.{player_id}": {"$exists": True}},
+            [
+                {"$set": {
+                    f"characters.{player_id}.exp": exp_expression(player_id, exp_gain),
+                    "version": VERSION_INCREMENT
+                }},
+                {"$set": {f"characters.{player_id}.level": level_expression(player_id)}}
+            ],
+            projection={"_id": 0, "version": 1, f"characters.{player_id}": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def apply_character_deltas(self, channel_id, deltas):
+        """Atomically apply HP and EXP changes to several characters in one update
+
+        deltas maps player_id to {"hp": change, "exp": gain}, with the same clamping and
+        levelling as adjust_character_hp and add_character_exp. Returns the updated
+        characters and game version, or None if any of the characters doesn't exist.
+        """
+        stats = {"version": VERSION_INCREMENT}
+        levels = {}
+        for player_id, delta in deltas.items():
+            if delta.get("hp"):
+                stats[f"characters.{player_id}.hp"] = hp_expression(player_id, delta["hp"])
+            if delta.get("exp"):
+                stats[f"characters.{player_id}.exp"] = exp_expression(player_id, delta["exp"])
+                levels[f"characters.{player_id}.level"] = level_expression(player_id)
+        pipeline = [{"$set": stats}]
+        if levels:
+            pipeline.append({"$set": levels})
+        query = {"channel_id": str(channel_id)}
+        query.update({f"characters.{player_id}": {"$exists": True} for player_id in deltas})
+        return await self.games.find_one_and_update(
+            query,
+            pipeline,
+            projection={"_id": 0, "version": 1, **{f"characters.{player_id}": 1 for player_id in deltas}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def push_game_history(self, channel_id, entry, limit=20):
+        """Append a history entry, keeping only the most recent `limit` entries
+
+        Returns the updated history and game version.
+        """
+        return await self.games.find_one_and_update(
+            {"channel_id": str(channel_id)},
+            {"$push": {"history": {"$each": [entry], "$slice": -limit}}, "$inc": {"version": 1}},
+            projection={"_id": 0, "version": 1, "history": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def delete_game(self, channel_id):
+        await self.games.delete_one({"channel_id": str(channel_id)})
+
+    async def get_game_by_ic_channel(self, ic_channel_id):
+        return await self.games.find_one({"ic_channel_id": str(ic_channel_id)})
+
+    async def get_game_by_ooc_thread(self, ooc_thread_id):
+        return await self.games.find_one({"ooc_thread_id": str(ooc_thread_id)})
+
+    async def get_games_in_states(self, states):
+        """Load every game in one of the given states with a single query"""
+        return await self.games.find({"state": {"$in": list(states)}}).to_list(length=None)
+
+    def stats(self):
+        pool_stats = self.pool_listener.stats()
+        pool_stats["max_pool_size"] = self.max_pool_size
+        pool_stats["min_pool_size"] = self.min_pool_size
+        return pool_stats
+
+    def close(self):
+        self.client.close()
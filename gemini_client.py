@@ -0,0 +1,114 @@
+import asyncio
+import contextlib
+
+def estimate_tokens(text):
+    """Rough token count used for prompt budgets (Gemini averages about four characters per token)"""
+    return len(text) // 4 + 1
+
+class GeminiClient:
+    """Async access to Gemini with an explicit concurrency limit and per-call deadlines
+
+    Calls use the SDK's native async API instead of blocking threads, so the number
+    of requests in flight is bounded by max_concurrency rather than by the default
+    executor's thread count. The deadline covers waiting for a slot and the call itself.
+    """
+    def __init__(self, max_concurrency=8, timeout=60):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, timeout):
+        """Hold a concurrency slot for one request, keeping the counters up to date
+
+        Yields a function returning the seconds left before the deadline, which also
+        covers waiting for the slot.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+
+        def remaining():
+            return max(deadline - loop.time(), 0)
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), remaining())
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.calls += 1
+        try:
+            yield remaining
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    async def _call(self, make_request, timeout):
+        async with self._slot(timeout) as remaining:
+            return await asyncio.wait_for(make_request(), remaining())
+
+    async def send_message(self, chat, content, timeout=None):
+        """Send a message on a ChatSession and return the response"""
+        return await self._call(lambda: chat.send_message_async(content), timeout)
+
+    async def generate_content(self, model, contents, timeout=None):
+        """Run a one-off generation on a GenerativeModel and return the response"""
+        return await self._call(lambda: model.generate_content_async(contents), timeout)
+
+    async def stream_message(self, chat, content, timeout=None):
+        """Yield the text of a chat response chunk by chunk as it is generated
+
+        The deadline applies to the whole stream, including waiting for a slot.
+        """
+        async with self._slot(timeout) as remaining:
+            response = await asyncio.wait_for(chat.send_message_async(content, stream=True), remaining())
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), remaining())
+                except StopAsyncIteration:
+                    break
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. only a finish reason) carry nothing to show
+                    continue
+                if text:
+                    yield text
+
+    async def summarize(self, model, turns, previous_summary="", subject="conversation", max_words=200, timeout=None):
+        """Condense {"role", "content"} turns, plus any earlier summary, into one running summary"""
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        prompt = (
+            f"Summarize this {subject} in at most {max_words} words. Keep names, places, goals, "
+            "promises and unresolved threads that later turns may rely on. Reply with the summary only.\n\n"
+        )
+        if previous_summary:
+            prompt += f"Summary so far:\n{previous_summary}\n\n"
+        prompt += f"Turns to fold in:\n{transcript}"
+        response = await self.generate_content(model, prompt, timeout)
+        return response.text.strip()
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "errors": self.errors
+        }
@@ -0,0 +1,138 @@
+import json
+import re
+from collections import namedtuple
+
+# kind is "scene", "npc", "roll", "hp" or "exp"; name is the NPC or character (None for scenes);
+# value is the description, the roll to make, the HP delta or the EXP gained
+NarrationEvent = namedtuple("NarrationEvent", ["kind", "name", "value"])
+ParsedNarration = namedtuple("ParsedNarration", ["text", "events"])
+
+# Every tag and stat phrase in one alternation, so a narration is scanned exactly once.
+# Tags run to the end of their line and are case-sensitive; stat phrases are not.
+TOKEN_PATTERN = re.compile(
+    r"(?P<tag>SCENE|NPC|PENDING_ROLL): (?P<body>[^\n]*)(?P<newline>\n?)"
+    r"|\b(?P<name>\w+) (?i:takes (?P<damage>\d+) damage|heals for (?P<heal>\d+)|gains (?P<exp>\d+) EXP)"
+)
+ROLL_PATTERN = re.compile(r"(\w+) must roll (.+)")
+
+def parse_narration(narration):
+    """Walk a narration once, returning the text to display and the events it contains
+
+    SCENE: and NPC: lines are removed from the text, PENDING_ROLL: lines become a
+    request to roll, and HP/EXP phrases stay in the text as they are.
+    """
+    pieces = []
+    events = []
+    position = 0
+    for match in TOKEN_PATTERN.finditer(narration):
+        pieces.append(narration[position:match.start()])
+        position = match.end()
+        tag = match.group("tag")
+        if tag == "SCENE":
+            events.append(NarrationEvent("scene", None, match.group("body").strip()))
+        elif tag == "NPC":
+            name, separator, description = match.group("body").partition(":")
+            if separator and name.strip():
+                events.append(NarrationEvent("npc", name.strip(), description.strip()))
+        elif tag == "PENDING_ROLL":
+            roll_match = ROLL_PATTERN.match(match.group("body"))
+            if roll_match:
+                character, roll = roll_match.groups()
+                events.append(NarrationEvent("roll", character, roll.strip()))
+                pieces.append(f"{character}, please roll {roll.strip()} in your next reply.")
+            else:
+                pieces.append(match.group("body"))
+            pieces.append(match.group("newline"))
+        else:
+            pieces.append(match.group(0))
+            if match.group("damage"):
+                events.append(NarrationEvent("hp", match.group("name"), -int(match.group("damage"))))
+            elif match.group("heal"):
+                events.append(NarrationEvent("hp", match.group("name"), int(match.group("heal"))))
+            else:
+                events.append(NarrationEvent("exp", match.group("name"), int(match.group("exp"))))
+    pieces.append(narration[position:])
+    return ParsedNarration("".join(pieces).strip(), events)
+
+# Response schema for the JSON narration mode; the same information the tags and stat phrases carry
+NARRATION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "narration": {"type": "STRING"},
+        "scene": {"type": "STRING"},
+        "npcs": {"type": "ARRAY", "items": {
+            "type": "OBJECT",
+            "properties": {"name": {"type": "STRING"}, "description": {"type": "STRING"}},
+            "required": ["name", "description"]
+        }},
+        "rolls": {"type": "ARRAY", "items": {
+            "type": "OBJECT",
+            "properties": {"character": {"type": "STRING"}, "roll": {"type": "STRING"}},
+            "required": ["character", "roll"]
+        }},
+        "character_changes": {"type": "ARRAY", "items": {
+            "type": "OBJECT",
+            "properties": {
+                "character": {"type": "STRING"},
+                "hp_change": {"type": "INTEGER"},
+                "exp_gained": {"type": "INTEGER"}
+            },
+            "required": ["character"]
+        }}
+    },
+    "required": ["narration"]
+}
+
+def _text(value):
+    """A stripped string field, or "" for null and non-string values"""
+    return value.strip() if isinstance(value, str) else ""
+
+def _objects(value):
+    """The objects of an array field, skipping null and non-object entries"""
+    return [item for item in value if isinstance(item, dict)] if isinstance(value, list) else []
+
+def _int(value):
+    """An integer field, or 0 for null and non-numeric values"""
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def parse_structured_narration(payload):
+    """Turn a JSON narration response into the same display text and events as parse_narration
+
+    Null or missing fields are treated as empty. Falls back to parse_narration if the model
+    didn't return valid JSON or a field has an unusable type.
+    """
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return parse_narration(payload)
+    if not isinstance(data, dict):
+        return parse_narration(payload)
+
+    try:
+        events = []
+        lines = [_text(data.get("narration"))]
+        if _text(data.get("scene")):
+            events.append(NarrationEvent("scene", None, _text(data["scene"])))
+        for npc in _objects(data.get("npcs")):
+            if _text(npc.get("name")):
+                events.append(NarrationEvent("npc", _text(npc["name"]), _text(npc.get("description"))))
+        for change in _objects(data.get("character_changes")):
+            character = _text(change.get("character"))
+            if not character:
+                continue
+            hp_change, exp_gained = _int(change.get("hp_change")), _int(change.get("exp_gained"))
+            if hp_change:
+                events.append(NarrationEvent("hp", character, hp_change))
+            if exp_gained > 0:
+                events.append(NarrationEvent("exp", character, exp_gained))
+        for roll in _objects(data.get("rolls")):
+            character, value = _text(roll.get("character")), _text(roll.get("roll"))
+            if character and value:
+                events.append(NarrationEvent("roll", character, value))
+                lines.append(f"{character}, please roll {value} in your next reply.")
+    except (TypeError, ValueError):
+        return parse_narration(payload)
+    return ParsedNarration("\n".join(line for line in lines if line), events)
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+
+# Global files written by older versions, each mapping IC channel IDs to one kind of state
+LEGACY_FILES = {
+    "world_details.json": "world_details",
+    "npc_database.json": "npcs",
+    "scene_descriptions.json": "scene",
+}
+LEGACY_HISTORY_FILE = "narration_history.json"
+
+class NarrationStore:
+    """Narration state persisted as one JSON file per IC channel
+
+    Changes only mark a channel dirty. A flush `delay` seconds later writes just the
+    dirty channels from a worker thread, each to a temporary file that is then renamed
+    over the old one, so a crash never leaves a half-written file behind.
+    """
+    def __init__(self, folder, snapshot, delay=5.0):
+        self.folder = folder
+        self.channels_folder = os.path.join(folder, "channels")
+        os.makedirs(self.channels_folder, exist_ok=True)
+        self.snapshot = snapshot  # channel_id -> JSON-ready state, or None once the channel is gone
+        self.delay = delay
+        self.dirty = set()
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+        self.flushes = 0
+        self.files_written = 0
+
+    def path_for(self, channel_id):
+        return os.path.join(self.channels_folder, f"{channel_id}.json")
+
+    def load_all(self):
+        """Read every channel's saved state; runs once at startup"""
+        self.migrate_legacy_files()
+        states = {}
+        for filename in os.listdir(self.channels_folder):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.channels_folder, filename), 'r') as f:
+                    states[filename[:-len(".json")]] = json.load(f)
+            except Exception as e:
+                print(f"Error loading narration data from {filename}: {e}")
+        return states
+
+    def migrate_legacy_files(self):
+        """Split the old global files into per-channel files, keeping the originals as *.migrated"""
+        states = {}
+        for filename, key in LEGACY_FILES.items():
+            data = self._read_legacy(filename)
+            for channel_id, value in data.items():
+                states.setdefault(channel_id, {})[key] = value
+        for channel_id, saved in self._read_legacy(LEGACY_HISTORY_FILE).items():
+            state = states.setdefault(channel_id, {})
+            state["summary"] = saved.get("summary", "")
+            state["turns"] = saved.get("turns", [])
+        if not states:
+            return
+
+        for channel_id, state in states.items():
+            # Per-channel files written since take precedence over the legacy data
+            if not os.path.exists(self.path_for(channel_id)):
+                self._write_file(channel_id, state)
+        for filename in list(LEGACY_FILES) + [LEGACY_HISTORY_FILE]:
+            path = os.path.join(self.folder, filename)
+            if os.path.exists(path):
+                os.replace(path, path + ".migrated")
+        print(f"Migrated narration data for {len(states)} channels to per-channel files")
+
+    def _read_legacy(self, filename):
+        path = os.path.join(self.folder, filename)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error reading legacy narration file {filename}: {e}")
+            return {}
+
+    def _write_file(self, channel_id, state):
+        path = self.path_for(channel_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _write_files(self, states):
+        for channel_id, state in states.items():
+            self._write_file(channel_id, state)
+
+    def mark_dirty(self, channel_id):
+        """Schedule a channel's state to be written with the next debounced flush"""
+        self.dirty.add(channel_id)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        # Changes made while this flush writes schedule a flush of their own
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Write every dirty channel now"""
+        async with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            states = {}
+            for channel_id in dirty:
+                state = self.snapshot(channel_id)
+                if state is not None:
+                    states[channel_id] = state
+            if not states:
+                return
+            try:
+                await asyncio.to_thread(self._write_files, states)
+                self.flushes += 1
+                self.files_written += len(states)
+            except Exception as e:
+                print(f"Error saving narration data: {e}")
+                # Try these channels again after another delay
+                for channel_id in states:
+                    self.mark_dirty(channel_id)
+
+    async def delete(self, channel_id):
+        """Forget a channel's pending changes and remove its file"""
+        self.dirty.discard(channel_id)
+        async with self.lock:
+            path = self.path_for(channel_id)
+            if os.path.exists(path):
+                await asyncio.to_thread(os.remove, path)
+
+    async def close(self):
+        """Cancel the scheduled flush and write everything still dirty"""
+        if self.flush_task is not None and not self.flush_task.done():
+            self.flush_task.cancel()
+        await self.flush()
+        # A failed final write leaves nothing to retry it
+        if self.flush_task is not None and not self.flush_task.done():
+            self.flush_task.cancel()
+
+    def stats(self):
+        return {
+            "dirty_channels": len(self.dirty),
+            "flushes": self.flushes,
+            "files_written": self.files_written
+        }